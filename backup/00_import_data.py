@@ -1,12 +1,16 @@
 import os
 import glob
-
-import matplotlib.pyplot as plt
+import sys
 
 import mne
+import numpy as np
+
+from mne_nirs.preprocessing import scalp_coupling_index_windowed
 
-from mne_nirs.preprocessing import peak_power, scalp_coupling_index_windowed
-from mne_nirs.visualisation import plot_timechannel_quality_metric
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import DECIMATED_SFREQ  # noqa: E402
+from preprocessing import decimate, tddr  # noqa: E402
+from qc_report import QCReport  # noqa: E402
 
 # %%
 # set-up file naming pattern
@@ -20,6 +24,9 @@ files = glob.glob(pattern)
 files.sort()
 
 # %%
+# QC panels of all subjects are rendered into one reused figure
+report = QCReport(threshold=0.5)
+
 for file in files:
 
     # import the data
@@ -41,41 +48,31 @@ for file in files:
         }
     )
 
-    event_dict = {
-        "Resting State": 0,
-        "Sham": 1,
-        "2 Hz": 2,
-        "10 Hz": 3,
-        "25 Hz": 4,
-        "40 Hz": 5,
-    }
-
-    fig, ax = plt.subplots(figsize=(8, 6))
-    mne.viz.plot_events(events,
-                        event_id=event_dict,
-                        sfreq=raw_data.info['sfreq'],
-                        axes=ax,
-                        show=False)
-    ax.set_xlim(-250, raw_data.times[-1]+250)
-    ax.set_title(os.path.dirname(file).split('/')[-1] + ' - ' + os.path.basename(file))
-    fig.savefig('results/' + os.path.dirname(file).split('/')[-1].split(',')[0] + '_trigger.png')
-
     # %%
     raw_od = mne.preprocessing.nirs.optical_density(raw_data)
 
     tmin, tmax = events[1, 0] / sfreq, (events[1, 0] / sfreq) + 360
     raw_sig = raw_od.copy().crop(tmin, tmax)
     sci = mne.preprocessing.nirs.scalp_coupling_index(raw_sig)
-    fig, ax = plt.subplots(layout="constrained")
-    ax.hist(sci)
-    ax.set(xlabel="Scalp Coupling Index", ylabel="Count", xlim=[0, 1])
-    ax.set_title(os.path.dirname(file).split('/')[-1] + ' - ' + os.path.basename(file))
-    fig.savefig('results/' + os.path.dirname(file).split('/')[-1].split(',')[0] + '_sci.png')
 
     _, scores, times = scalp_coupling_index_windowed(raw_od, time_window=60)
-    fig = plot_timechannel_quality_metric(raw_od, scores, times, threshold=0.5,
-                                          title="Scalp Coupling Index "
-                                          "Quality Evaluation")
-    fig.set_size_inches(30, 25)
-    fig.savefig('results/' + os.path.dirname(file).split('/')[-1].split(',')[0] + '_metric.png')
-    plt.close('all')
+    subject = os.path.dirname(file).split('/')[-1].split(',')[0]
+
+    # %%
+    # the SCI needs the cardiac band; motion correction (TDDR) runs on the decimated
+    # optical density, which is stored for the connectivity stages
+    od_low, sfreq_low = decimate(raw_od.get_data(), sfreq, DECIMATED_SFREQ, chunk_size=4096)
+    od_low = tddr(od_low, sfreq_low)
+    np.savez(os.path.join('results', f'{subject}_od.npz'),
+             data=od_low, sfreq=sfreq_low, ch_names=raw_od.ch_names)
+
+    # draw the subject's QC panels into the shared report figure
+    report.add(subject,
+               title=os.path.dirname(file).split('/')[-1] + ' - ' + os.path.basename(file),
+               sci=sci, scores=scores, times=times,
+               events=events, sfreq=sfreq,
+               ch_names=raw_od.ch_names)
+
+# %%
+# one report for the whole cohort
+report.write_html('results/qc_report.html')
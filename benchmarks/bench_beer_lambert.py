@@ -0,0 +1,76 @@
+"""Time, peak memory and accuracy of the batched Beer-Lambert conversion.
+
+Compares a per-pair float64 conversion (as in ``mne.preprocessing.nirs.beer_lambert_law``,
+one pseudo-inverse and product per channel pair on a copy of the data) with the batched
+conversion in float64 and in float32, in place into preallocated buffers.
+
+Usage
+-----
+    python benchmarks/bench_beer_lambert.py [--recordings 4] [--pairs 100] [--minutes 60] [--sfreq 7.81]
+"""
+import argparse
+
+import numpy as np
+
+from common import measure
+from preprocessing import beer_lambert_cohort, inverse_extinction_matrix, _absorption
+
+WAVELENGTHS = (760, 850)
+
+
+def synthetic_od(n_pairs, n_times, seed=0):
+    rng = np.random.default_rng(seed)
+    od = rng.standard_normal((2 * n_pairs, n_times)).cumsum(axis=1) * 1e-3
+    distances = rng.uniform(0.02, 0.04, 2 * n_pairs)
+    return od, distances
+
+
+def per_pair_reference(od, distances, ppf=6.0):
+    """Per-pair conversion following MNE, on a float64 copy of the data."""
+    data = od.astype(np.float64, copy=True)
+    abs_coef = _absorption(WAVELENGTHS)
+    for ii, jj in zip(range(0, len(data), 2), range(1, len(data), 2)):
+        EL = abs_coef * distances[ii] * ppf
+        iEL = np.linalg.pinv(EL)
+        data[[ii, jj]] = iEL @ data[[ii, jj]] * 1e-3
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recordings', type=int, default=4)
+    parser.add_argument('--pairs', type=int, default=100)
+    parser.add_argument('--minutes', type=float, default=60)
+    parser.add_argument('--sfreq', type=float, default=7.81)
+    parser.add_argument('--n-jobs', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    n_times = int(args.minutes * 60 * args.sfreq)
+    cohort = [synthetic_od(args.pairs, n_times, seed) for seed in range(args.recordings)]
+    recordings = [(od, dist, WAVELENGTHS) for od, dist in cohort]
+    inverse_extinction_matrix(WAVELENGTHS)  # warm the cache
+
+    ref = [per_pair_reference(od, dist) for od, dist in cohort]
+    buffers = [np.empty(od.shape, dtype=np.float32) for od, _ in cohort]
+
+    cases = dict(
+        per_pair_float64=lambda: [per_pair_reference(od, dist) for od, dist in cohort],
+        batched_float64=lambda: beer_lambert_cohort(recordings, dtype=np.float64, n_jobs=args.n_jobs),
+        batched_float32_preallocated=lambda: beer_lambert_cohort(recordings, dtype=np.float32, out=buffers,
+                                                                 n_jobs=args.n_jobs),
+    )
+
+    print(f"{args.recordings} recordings, {2 * args.pairs} channels, {n_times} samples each")
+    print(f"{'case':<30} {'s/subject':>10} {'MB/subject':>11} {'max rel err':>12}")
+    for name, func in cases.items():
+        res = measure(func)
+        out = func()
+        # error relative to each channel's peak amplitude
+        err = max(float(np.max(np.abs(o - r) / np.max(np.abs(r), axis=1, keepdims=True)))
+                  for o, r in zip(out, ref))
+        print(f"{name:<30} {res['seconds'] / args.recordings:>10.4f} {res['peak_mb'] / args.recordings:>11.1f} "
+              f"{err:>12.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""File size and save time of circle plots against the number of drawn connections.
+
+Compares the default vector output with a rasterized edge layer and with the level-of-detail
+mode (strongest connections individually, weak ones as density layers) for each output
+format. Runs offline on synthetic data with the Agg backend.
+
+Usage
+-----
+    python benchmarks/bench_circle_lod.py [--edges 100 1000 5000 20000 50000] [--formats png svg pdf]
+"""
+import argparse
+import json
+import os
+import os.path as op
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt  # noqa: E402
+
+from common import synthetic_connectivity  # noqa: E402
+from circular import plot_connectivity_circle  # noqa: E402
+
+MODES = dict(vector=dict(),
+             rasterized=dict(rasterize_edges=True),
+             lod=dict(rasterize_edges=True, edge_lod_threshold=500))
+
+
+def bench_one(con, node_names, n_edges, fmt, dpi, **kwargs):
+    start = time.perf_counter()
+    fig, _ = plot_connectivity_circle(con, node_names, n_lines=n_edges, colormap='RdBu_r', vmin=-1, vmax=1,
+                                      fontsize_names=4, show=False, **kwargs)
+    t_plot = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = op.join(tmp, f'circle.{fmt}')
+        start = time.perf_counter()
+        fig.savefig(fname, dpi=dpi)
+        t_save = time.perf_counter() - start
+        size = os.path.getsize(fname)
+    plt.close(fig)
+    return dict(plot_seconds=t_plot, save_seconds=t_save, bytes=size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--edges', type=int, nargs='+', default=[100, 1000, 5000, 20000, 50000])
+    parser.add_argument('--formats', nargs='+', default=['png', 'svg', 'pdf'])
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    parser.add_argument('--dpi', type=int, default=300)
+    parser.add_argument('--json', default=None, metavar='FILE', help='Also write the results to FILE.')
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'edges':>7} {'format':>6} {'mode':>10} {'plot [s]':>9} {'save [s]':>9} {'size [kB]':>10}")
+    for n_edges in args.edges:
+        con, node_names = synthetic_connectivity(n_edges)
+        for fmt in args.formats:
+            for mode in args.modes:
+                res = bench_one(con, node_names, n_edges, fmt, args.dpi, **MODES[mode])
+                res.update(edges=n_edges, format=fmt, mode=mode)
+                results.append(res)
+                print(f"{n_edges:>7} {fmt:>6} {mode:>10} {res['plot_seconds']:>9.2f} {res['save_seconds']:>9.2f} "
+                      f"{res['bytes'] / 1024:>10.1f}")
+
+    if args.json is not None:
+        with open(args.json, 'w') as fid:
+            json.dump(results, fid, indent=2)
+
+
+if __name__ == '__main__':
+    main()
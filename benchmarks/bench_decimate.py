@@ -0,0 +1,98 @@
+"""Verify and time the polyphase decimation stage.
+
+Checks that chunked ``preprocessing.decimate`` equals ``scipy.signal.resample_poly``, and
+that correlation and spectral connectivity computed after decimation agree with the
+results at the native sampling rate within tolerance. Also times the downstream stages
+(TDDR, correlation, spectral connectivity) at both rates. Signals are synthetic: shared
+slow hemodynamic components, a cardiac oscillation and white noise.
+
+Usage
+-----
+    python benchmarks/bench_decimate.py [--channels 100] [--minutes 20] [--sfreq 7.8125] [--target 2.0]
+
+Exits with status 1 if a check fails.
+"""
+import argparse
+import sys
+
+import numpy as np
+from scipy.signal import butter, resample_poly, sosfiltfilt
+
+from common import measure
+from config import DECIMATED_SFREQ
+from preprocessing import Decimator, decimate, tddr
+from spectral import band_connectivity
+
+
+def synthetic_hemodynamics(n_channels, n_times, sfreq, n_sources=5, seed=0):
+    rng = np.random.default_rng(seed)
+    sos = butter(4, (0.01, 0.15), btype='bandpass', fs=sfreq, output='sos')
+    sources = sosfiltfilt(sos, rng.standard_normal((n_sources, n_times)), axis=-1)
+    sources /= sources.std(axis=1, keepdims=True)
+    t = np.arange(n_times) / sfreq
+    cardiac = np.sin(2 * np.pi * 1.1 * t + rng.uniform(0, 2 * np.pi, (n_channels, 1)))
+    mixing = rng.standard_normal((n_channels, n_sources))
+    return mixing @ sources + 0.5 * cardiac + 0.5 * rng.standard_normal((n_channels, n_times))
+
+
+def correlation(data, sfreq, trim):
+    sos = butter(4, (0.01, 0.1), btype='bandpass', fs=sfreq, output='sos')
+    filtered = sosfiltfilt(sos, data, axis=-1)
+    n_trim = int(trim * sfreq)
+    return np.corrcoef(filtered[:, n_trim:-n_trim])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--channels', type=int, default=100)
+    parser.add_argument('--minutes', type=float, default=20)
+    parser.add_argument('--sfreq', type=float, default=7.8125)
+    parser.add_argument('--target', type=float, default=DECIMATED_SFREQ)
+    parser.add_argument('--chunk', type=int, default=256, help='Input samples per streaming chunk.')
+    parser.add_argument('--seg-duration', type=float, default=64.0,
+                        help='Welch segment length in s, a whole number of samples at both rates.')
+    parser.add_argument('--tolerance', type=float, default=0.02)
+    args = parser.parse_args(argv)
+
+    n_times = int(args.minutes * 60 * args.sfreq)
+    data = synthetic_hemodynamics(args.channels, n_times, args.sfreq)
+    low, sfreq_low = decimate(data, args.sfreq, args.target, chunk_size=args.chunk)
+    decimator = Decimator(args.sfreq, args.target)
+    print(f"{args.channels} channels, {n_times} samples at {args.sfreq} Hz -> {low.shape[1]} samples at "
+          f"{sfreq_low:g} Hz (up {decimator.up}, down {decimator.down}, {len(decimator.h)} taps)\n")
+
+    checks = []
+    ref = resample_poly(data, decimator.up, decimator.down, axis=-1)
+    checks.append(('chunked decimate vs resample_poly', float(np.max(np.abs(low - ref))), 1e-10))
+
+    corr_diff = np.abs(correlation(data, args.sfreq, 60) - correlation(low, sfreq_low, 60))
+    checks.append(('correlation 0.01-0.1 Hz', float(np.max(corr_diff)), args.tolerance))
+
+    # segments have to span the same samples at both rates for the estimates to agree
+    spec_native = band_connectivity(data, args.sfreq, seg_duration=args.seg_duration)
+    spec_low = band_connectivity(low, sfreq_low, seg_duration=args.seg_duration)
+    for measure_name in spec_native:
+        diff = float(np.nanmax(np.abs(spec_native[measure_name] - spec_low[measure_name])))
+        checks.append((f'spectral {measure_name}', diff, args.tolerance))
+
+    failed = False
+    print(f"{'check':<36} {'max abs diff':>13} {'tolerance':>10}")
+    for name, diff, tolerance in checks:
+        ok = diff <= tolerance
+        failed |= not ok
+        print(f"{name:<36} {diff:>13.2e} {tolerance:>10.0e}  {'ok' if ok else 'FAIL'}")
+
+    cost = measure(lambda: decimate(data, args.sfreq, args.target, chunk_size=args.chunk), repeat=1, memory=False)
+    print(f"\ndecimation: {cost['seconds']:.3f} s")
+    print(f"{'stage':<24} {'native [s]':>11} {'decimated [s]':>14}")
+    stages = [('tddr', tddr), ('correlation', lambda x, s: correlation(x, s, 60)), ('spectral', band_connectivity)]
+    for name, func in stages:
+        native = measure(lambda: func(data, args.sfreq), repeat=1, memory=False)
+        reduced = measure(lambda: func(low, sfreq_low), repeat=1, memory=False)
+        print(f"{name:<24} {native['seconds']:>11.3f} {reduced['seconds']:>14.3f}")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""Import-time benchmark guarding the startup cost of the plotting and CLI modules.
+
+Each module is imported in a fresh interpreter several times and the best wall time is
+compared against a budget. The script also checks that no MNE package is imported as a
+side effect. It exits with status 1 if any module exceeds its budget.
+
+Usage
+-----
+    python benchmarks/bench_import.py [--repeat 5] [--scale 1.0]
+
+``--scale`` multiplies all budgets, e.g. for slow network filesystems.
+"""
+import argparse
+import json
+import os.path as op
+import subprocess
+import sys
+
+ROOT = op.dirname(op.dirname(op.abspath(__file__)))
+
+# module -> import time budget in seconds
+BUDGETS = dict(circular=0.5, cli=0.5, contrasts=0.5)
+
+_PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = sorted(name for name in sys.modules if name.split('.')[0] in ('mne', 'mne_connectivity', 'mne_nirs'))
+print(elapsed, ','.join(heavy))
+"""
+
+
+def time_import(module, repeat=5):
+    """
+    Import ``module`` in ``repeat`` fresh interpreters.
+
+    Returns:
+    -------
+    best : float
+        The fastest import time in seconds.
+    heavy : list of str
+        MNE modules that were imported as a side effect.
+    """
+    best, heavy = float('inf'), []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', _PROBE.format(module=module)],
+                             cwd=ROOT, capture_output=True, text=True, check=True).stdout.split()
+        best = min(best, float(out[0]))
+        heavy = out[1].split(',') if len(out) > 1 else []
+    return best, heavy
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply all budgets by this factor.')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    args = parser.parse_args(argv)
+
+    results, failed = {}, False
+    for module, budget in BUDGETS.items():
+        best, heavy = time_import(module, args.repeat)
+        ok = best <= budget * args.scale and not heavy
+        failed |= not ok
+        results[module] = dict(seconds=best, budget=budget * args.scale, heavy_imports=heavy, ok=ok)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for module, res in results.items():
+            status = 'ok' if res['ok'] else 'FAIL'
+            extra = f" (imports {', '.join(res['heavy_imports'])})" if res['heavy_imports'] else ''
+            print(f"{module:<12} {res['seconds'] * 1000:8.1f} ms  budget {res['budget'] * 1000:6.0f} ms  {status}{extra}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""Verify and time the packed good-channel mask reductions.
+
+Checks that ``stats.ChannelMaskedTensor`` means and variances equal ``np.nanmean`` and
+``np.nanvar`` on synthetic ``R6`` tensors, including NaN values between good channels
+(a NaN diagonal and isolated NaN edges), and that the packed form survives a save/load
+round trip. Then times the reductions on the NaN tensor and on the loaded packed tensor.
+
+Usage
+-----
+    python benchmarks/bench_masked.py [--scales 1 10]
+
+Exits with status 1 if a check fails.
+"""
+import argparse
+import os.path as op
+import sys
+import tempfile
+import warnings
+
+import numpy as np
+
+from common import measure, synthetic_r6
+from stats import ChannelMaskedTensor
+
+
+def with_missing_edges(r6, n_edges=50, seed=0):
+    """Copy of ``r6`` with a NaN diagonal and isolated NaN edges between good channels."""
+    rng = np.random.default_rng(seed)
+    r6 = r6.copy()
+    diag = np.arange(r6.shape[-1])
+    r6[..., diag, diag] = np.nan
+    for _ in range(n_edges):
+        s, c, i, j = (rng.integers(n) for n in r6.shape)
+        r6[s, c, i, j] = r6[s, c, j, i] = np.nan
+    return r6
+
+
+def load_and_reduce(fname):
+    masked = ChannelMaskedTensor.load(fname)
+    return [masked.mean(condition) for condition in masked.conditions]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10])
+    args = parser.parse_args(argv)
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'check':<44} {'max abs diff':>13}")
+        r6 = with_missing_edges(synthetic_r6(1))
+        fname = op.join(tmp, 'r6.npz')
+        ChannelMaskedTensor.from_nan(r6).save(fname)
+        masked = ChannelMaskedTensor.load(fname)
+        for c, condition in enumerate(masked.conditions):
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN diagonal
+                refs = np.nanmean(r6[:, c], axis=0), np.nanvar(r6[:, c], axis=0, ddof=1)
+            for name, ref, res in (('mean', refs[0], masked.mean(condition)),
+                                   ('var', refs[1], masked.var(condition))):
+                same_nan = np.array_equal(np.isnan(ref), np.isnan(res))
+                diff = float(np.nanmax(np.abs(ref - res)))
+                ok = same_nan and diff < 1e-12
+                failed |= not ok
+                print(f"{name} {condition:<39} {diff:>13.2e}  {'ok' if ok else 'FAIL'}")
+        ok = np.array_equal(np.isnan(masked.to_nan()), np.isnan(r6))
+        failed |= not ok
+        print(f"{'to_nan restores the NaN pattern':<44} {'':>13}  {'ok' if ok else 'FAIL'}")
+
+        print(f"\n{'case':<44} {'time [s]':>9} {'peak [MB]':>10}")
+        for scale in args.scales:
+            r6 = synthetic_r6(scale)
+            fname = op.join(tmp, f'r6_x{scale}.npz')
+            ChannelMaskedTensor.from_nan(r6, dtype=np.float32).save(fname)
+            cases = [(f'nanmean all conditions x{scale}',
+                      lambda: [np.nanmean(r6[:, c], axis=0) for c in range(r6.shape[1])]),
+                     (f'from_nan x{scale}', lambda: ChannelMaskedTensor.from_nan(r6)),
+                     (f'load packed + mean all conditions x{scale}', lambda: load_and_reduce(fname))]
+            for name, func in cases:
+                res = measure(func)
+                print(f"{name:<44} {res['seconds']:>9.4f} {res['peak_mb']:>10.1f}")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""Time and peak memory of the loaders, tensor reductions, node reordering and circle rendering.
+
+Synthetic inputs are generated at realistic and scaled-up sizes: ``R6`` tensors at 1x and
+10x the number of subjects, label files with thousands of entries and connectivity with
+100 to 50k drawn edges. Figures are rendered and saved with the Agg backend.
+
+Usage
+-----
+    python benchmarks/bench_pipeline.py [--suites load reduce reorder render] [--scales 1 10]
+    python benchmarks/bench_pipeline.py --quick --json results/bench.json
+
+Compare the JSON output of two runs to see whether a change made a stage faster or slower.
+"""
+import argparse
+import json
+import os.path as op
+import tempfile
+
+import numpy as np
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt  # noqa: E402
+from scipy.io import savemat  # noqa: E402
+
+from common import measure, synthetic_r6, synthetic_labels, labels_cell, synthetic_connectivity  # noqa: E402
+from config import CONDITIONS  # noqa: E402
+
+
+def bench_load(scales, n_labels, tmp):
+    from utils import load_mat_file, load_labels_from_mat
+
+    results = []
+    for scale in scales:
+        fname = op.join(tmp, f'r6_x{scale}.mat')
+        savemat(fname, {'R6': synthetic_r6(scale)})
+        res = measure(lambda: load_mat_file(fname, 'R6'))
+        results.append(dict(suite='load', case=f'load_mat_file R6 x{scale}', **res))
+
+    for n in n_labels:
+        fname = op.join(tmp, f'labels_{n}.mat')
+        savemat(fname, {'Labels_1N': labels_cell(synthetic_labels(n))})
+        res = measure(lambda: load_labels_from_mat(fname, 'Labels_1N'))
+        results.append(dict(suite='load', case=f'load_labels_from_mat {n}', **res))
+    return results
+
+
+def bench_reduce(scales):
+    from contrasts import GroupMeans
+    from stats import ChannelMaskedTensor, GroupAccumulator
+
+    results = []
+    for scale in scales:
+        r6 = synthetic_r6(scale)
+
+        def nanmean_all():
+            return [np.nanmean(r6[:, c, :, :], axis=0) for c in range(len(CONDITIONS))]
+
+        masked = ChannelMaskedTensor.from_nan(r6)
+
+        def masked_mean_all():
+            return [masked.mean(condition) for condition in masked.conditions]
+
+        def group_contrast():
+            means = GroupMeans.from_tensors(dict(HC=r6, MDD=r6))
+            return means.contrast(dict(group='MDD', reference='HC', condition='rs1', baseline='sham'))
+
+        def accumulate():
+            return GroupAccumulator.from_tensor(r6)
+
+        results.append(dict(suite='reduce', case=f'nanmean all conditions x{scale}', **measure(nanmean_all)))
+        results.append(dict(suite='reduce', case=f'masked mean all conditions x{scale}',
+                            **measure(masked_mean_all)))
+        results.append(dict(suite='reduce', case=f'GroupMeans.contrast x{scale}', **measure(group_contrast)))
+        results.append(dict(suite='reduce', case=f'GroupAccumulator.from_tensor x{scale}',
+                            **measure(accumulate, repeat=1)))
+    return results
+
+
+def bench_reorder(n_labels):
+    from contrasts import hemisphere_order, reorder_matrix
+    from utils import add_occurrence_suffix
+
+    results = []
+    for n in n_labels:
+        labels = add_occurrence_suffix(synthetic_labels(n))
+        mat = np.random.default_rng(0).standard_normal((n, n))
+        res = measure(lambda: hemisphere_order(labels))
+        results.append(dict(suite='reorder', case=f'hemisphere_order {n}', **res))
+        order = hemisphere_order(labels)
+        res = measure(lambda: reorder_matrix(mat, order))
+        results.append(dict(suite='reorder', case=f'reorder_matrix {n}', **res))
+    return results
+
+
+def bench_render(edges, tmp, dpi):
+    from circular import plot_connectivity_circle
+
+    results = []
+    for n_edges in edges:
+        con, node_names = synthetic_connectivity(n_edges)
+
+        def render():
+            fig, _ = plot_connectivity_circle(con, node_names, n_lines=n_edges, colormap='RdBu_r',
+                                              vmin=-1, vmax=1, show=False)
+            return fig
+
+        def render_save():
+            fig = render()
+            fig.savefig(op.join(tmp, 'circle.png'), dpi=dpi)
+            plt.close(fig)
+
+        def render_only():
+            plt.close(render())
+
+        repeat = 1 if n_edges > 5000 else 3
+        results.append(dict(suite='render', case=f'plot {n_edges} edges', **measure(render_only, repeat)))
+        results.append(dict(suite='render', case=f'plot+savefig {n_edges} edges',
+                            **measure(render_save, repeat, memory=False)))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--suites', nargs='+', default=['load', 'reduce', 'reorder', 'render'],
+                        choices=['load', 'reduce', 'reorder', 'render'])
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('--labels', type=int, nargs='+', default=[134, 2000, 5000])
+    parser.add_argument('--edges', type=int, nargs='+', default=[100, 1000, 5000, 20000, 50000])
+    parser.add_argument('--dpi', type=int, default=300)
+    parser.add_argument('--quick', action='store_true', help='Only the smallest size of every suite.')
+    parser.add_argument('--json', default=None, metavar='FILE', help='Also write the results to FILE.')
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.scales, args.labels, args.edges, args.dpi = args.scales[:1], args.labels[:1], args.edges[:1], 100
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        if 'load' in args.suites:
+            results += bench_load(args.scales, args.labels, tmp)
+        if 'reduce' in args.suites:
+            results += bench_reduce(args.scales)
+        if 'reorder' in args.suites:
+            results += bench_reorder(args.labels)
+        if 'render' in args.suites:
+            results += bench_render(args.edges, tmp, args.dpi)
+
+    print(f"{'suite':<8} {'case':<42} {'time [s]':>9} {'peak [MB]':>10}")
+    for res in results:
+        peak = f"{res['peak_mb']:.1f}" if res['peak_mb'] is not None else '-'
+        print(f"{res['suite']:<8} {res['case']:<42} {res['seconds']:>9.4f} {peak:>10}")
+
+    if args.json is not None:
+        with open(args.json, 'w') as fid:
+            json.dump(results, fid, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Time and accuracy of the batched spectral connectivity engine.
+
+Compares a pairwise loop over ``scipy.signal.csd`` (one call per channel pair) with the
+batched Welch cross-spectra of ``spectral.cross_spectra`` for one stimulation block, and
+times the cohort computation with several worker threads.
+
+Usage
+-----
+    python benchmarks/bench_spectral.py [--channels 20 60 134] [--subjects 10] [--n-jobs 1 4]
+"""
+import argparse
+
+import numpy as np
+from scipy.signal import csd
+
+from common import measure
+from config import BLOCK_DURATION, CONDITIONS
+from spectral import band_connectivity, connectivity_tensors, cross_spectra
+
+
+def coherence_pairwise(data, sfreq, n_per_seg):
+    """Reference: magnitude coherence of all channel pairs, one ``csd`` call per pair."""
+    n_channels = len(data)
+    step = n_per_seg - int(0.5 * n_per_seg)
+    kwargs = dict(fs=sfreq, nperseg=n_per_seg, noverlap=n_per_seg - step)
+    power = [np.real(csd(ch, ch, **kwargs)[1]) for ch in data]
+    coh = np.zeros((len(power[0]), n_channels, n_channels))
+    for i in range(n_channels):
+        for j in range(i, n_channels):
+            _, sxy = csd(data[i], data[j], **kwargs)
+            coh[:, i, j] = coh[:, j, i] = np.abs(sxy) / np.sqrt(power[i] * power[j])
+    return coh
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--channels', type=int, nargs='+', default=[20, 60, 134])
+    parser.add_argument('--subjects', type=int, default=10)
+    parser.add_argument('--sfreq', type=float, default=7.81)
+    parser.add_argument('--seg-duration', type=float, default=100.0)
+    parser.add_argument('--n-jobs', type=int, nargs='+', default=[1, 4])
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    n_times = int(BLOCK_DURATION * args.sfreq)
+    n_per_seg = int(round(args.seg_duration * args.sfreq))
+
+    print(f"{'channels':>8} {'pairwise [s]':>13} {'batched [s]':>12} {'speed-up':>9} {'max abs diff':>13}")
+    for n_channels in args.channels:
+        data = rng.standard_normal((n_channels, n_times))
+        loop = measure(lambda: coherence_pairwise(data, args.sfreq, n_per_seg), repeat=1, memory=False)
+        batched = measure(lambda: cross_spectra(data, args.sfreq, seg_duration=args.seg_duration), memory=False)
+
+        _, sxy, _ = cross_spectra(data, args.sfreq, seg_duration=args.seg_duration)
+        power = np.real(np.diagonal(sxy, axis1=1, axis2=2))
+        coh = np.abs(sxy) / np.sqrt(power[:, :, None] * power[:, None, :])
+        diff = float(np.max(np.abs(coh - coherence_pairwise(data, args.sfreq, n_per_seg))))
+        print(f"{n_channels:>8} {loop['seconds']:>13.2f} {batched['seconds']:>12.3f} "
+              f"{loop['seconds'] / batched['seconds']:>9.1f} {diff:>13.2e}")
+
+    # rejected channels (NaN rows) have to come out as NaN in every measure
+    data = rng.standard_normal((10, n_times))
+    data[3] = np.nan
+    con = band_connectivity(data, args.sfreq, seg_duration=args.seg_duration)
+    print('\nNaN channel propagates: ' + ', '.join(
+        f"{measure} {'ok' if np.isnan(values[:, 3]).all() and np.isnan(values[:, :, 3]).all() else 'FAIL'}"
+        for measure, values in con.items()))
+
+    n_channels = args.channels[-1]
+    subjects = [[rng.standard_normal((n_channels, n_times)) for _ in CONDITIONS] for _ in range(args.subjects)]
+    print(f"\ncohort: {args.subjects} subjects x {len(CONDITIONS)} conditions x {n_channels} channels")
+    for n_jobs in args.n_jobs:
+        res = measure(lambda: connectivity_tensors(subjects, args.sfreq, seg_duration=args.seg_duration,
+                                                   n_jobs=n_jobs), repeat=1)
+        print(f"n_jobs={n_jobs:<3} {res['seconds']:8.2f} s  peak {res['peak_mb']:8.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
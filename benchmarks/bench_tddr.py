@@ -0,0 +1,85 @@
+"""Time and accuracy of the vectorized TDDR motion correction on long recordings.
+
+Compares a per-channel loop (the algorithm as implemented in MNE-NIRS) with the vectorized
+``preprocessing.tddr`` on synthetic signals with baseline shifts and spikes.
+
+Usage
+-----
+    python benchmarks/bench_tddr.py [--channels 200 400] [--minutes 60] [--sfreq 7.81] [--n-jobs 4]
+"""
+import argparse
+
+import numpy as np
+from scipy.signal import butter, filtfilt
+
+from common import measure
+from preprocessing import tddr
+
+
+def tddr_per_channel(signal, sample_rate):
+    """Reference: TDDR of a single channel (Fishburn et al., 2019)."""
+    signal = np.array(signal, dtype=np.float64)
+    Fc = 0.5 * 2 / sample_rate
+    signal_mean = np.mean(signal)
+    signal -= signal_mean
+    if Fc < 1:
+        fb, fa = butter(3, Fc)
+        signal_low = filtfilt(fb, fa, signal, padlen=0)
+    else:
+        signal_low = signal
+    signal_high = signal - signal_low
+
+    tune = 4.685
+    D = np.sqrt(np.finfo(signal.dtype).eps)
+    mu = np.inf
+    deriv = np.diff(signal_low)
+    w = np.ones(deriv.shape)
+    for _ in range(50):
+        mu0 = mu
+        mu = np.sum(w * deriv) / np.sum(w)
+        dev = np.abs(deriv - mu)
+        sigma = 1.4826 * np.median(dev)
+        r = dev / (sigma * tune)
+        w = ((1 - r ** 2) * (r < 1)) ** 2
+        if abs(mu - mu0) < D * max(abs(mu), abs(mu0)):
+            break
+
+    new_deriv = w * (deriv - mu)
+    signal_low_corrected = np.cumsum(np.insert(new_deriv, 0, 0.0))
+    signal_low_corrected = signal_low_corrected - np.mean(signal_low_corrected)
+    return signal_low_corrected + signal_high + signal_mean
+
+
+def synthetic_motion(n_channels, n_times, sfreq, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_times) / sfreq
+    data = 0.01 * np.sin(2 * np.pi * 0.1 * t) + 0.002 * rng.standard_normal((n_channels, n_times))
+    for ch in range(n_channels):
+        for onset in rng.choice(n_times - 20, 10, replace=False):
+            data[ch, onset:] += rng.normal(0, 0.05)  # baseline shift
+            data[ch, onset:onset + 5] += rng.normal(0, 0.2)  # spike
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--channels', type=int, nargs='+', default=[200, 400])
+    parser.add_argument('--minutes', type=float, default=60)
+    parser.add_argument('--sfreq', type=float, default=7.81)
+    parser.add_argument('--n-jobs', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    n_times = int(args.minutes * 60 * args.sfreq)
+    print(f"{'channels':>8} {'samples':>8} {'loop [s]':>9} {'vectorized [s]':>15} {'speed-up':>9} {'max abs diff':>13}")
+    for n_channels in args.channels:
+        data = synthetic_motion(n_channels, n_times, args.sfreq)
+        loop = measure(lambda: [tddr_per_channel(ch, args.sfreq) for ch in data], repeat=1, memory=False)
+        vec = measure(lambda: tddr(data, args.sfreq, n_jobs=args.n_jobs), repeat=1, memory=False)
+        ref = np.array([tddr_per_channel(ch, args.sfreq) for ch in data])
+        diff = float(np.max(np.abs(tddr(data, args.sfreq) - ref)))
+        print(f"{n_channels:>8} {n_times:>8} {loop['seconds']:>9.2f} {vec['seconds']:>15.2f} "
+              f"{loop['seconds'] / vec['seconds']:>9.1f} {diff:>13.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Synthetic data generators and a small timing/memory harness shared by the benchmarks.
+
+Everything here runs offline on CPU; no recordings or result files are needed.
+"""
+import gc
+import os.path as op
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = op.dirname(op.dirname(op.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# realistic size of a group result tensor (subjects x conditions x channels x channels)
+R6_SHAPE = (30, 7, 134, 134)
+
+_REGIONS = ('Frontal_Sup', 'Frontal_Mid', 'Precentral', 'Postcentral', 'Parietal_Sup', 'Precuneus',
+            'Supramarginal', 'Temporal_Mid', 'Temporal_Sup', 'Occipital_Mid', 'Calcarine', 'Lingual',
+            'Cerebelum_Crus1', 'Motor_Supp')
+
+
+def synthetic_r6(scale=1, shape=R6_SHAPE, bad_channel_fraction=0.1, seed=0):
+    """
+    Random correlation tensor shaped like ``R6`` with rejected channels set to NaN.
+
+    Parameters:
+    ----------
+    scale : int
+        Multiplies the number of subjects, e.g. 10 for a 10x cohort.
+    shape : tuple of int
+        Shape of the tensor at scale 1.
+    bad_channel_fraction : float
+        Fraction of channels per subject and condition whose rows and columns are NaN.
+    seed : int
+        Seed of the random number generator.
+    """
+    rng = np.random.default_rng(seed)
+    n_sub, n_cond, n_ch, _ = shape
+    n_sub *= scale
+    r6 = rng.uniform(-1, 1, (n_sub, n_cond, n_ch, n_ch))
+    r6 = (r6 + r6.transpose(0, 1, 3, 2)) / 2
+
+    n_bad = int(round(bad_channel_fraction * n_ch))
+    for s in range(n_sub):
+        for c in range(n_cond):
+            bad = rng.choice(n_ch, n_bad, replace=False)
+            r6[s, c, bad, :] = np.nan
+            r6[s, c, :, bad] = np.nan
+    return r6
+
+
+def synthetic_labels(n_labels, seed=0):
+    """
+    Region labels in the ``<Region>_<L|R>_<n>`` format of the depth labeling files.
+    """
+    rng = np.random.default_rng(seed)
+    regions = rng.choice(len(_REGIONS), n_labels)
+    hemis = rng.choice(['L', 'R'], n_labels)
+    return [f"{_REGIONS[r]}_{h}" for r, h in zip(regions, hemis)]
+
+
+def labels_cell(labels):
+    """
+    Pack labels into an object array that ``scipy.io.savemat`` writes as a cell array.
+    """
+    cell = np.empty((len(labels), 1), dtype=object)
+    for i, label in enumerate(labels):
+        cell[i, 0] = np.array([label])
+    return cell
+
+
+def synthetic_connectivity(n_edges, seed=0):
+    """
+    Random symmetric connectivity with just enough nodes to hold ``n_edges`` connections.
+    """
+    n_nodes = int(np.ceil((1 + np.sqrt(1 + 8 * n_edges)) / 2))
+    rng = np.random.default_rng(seed)
+    con = rng.uniform(-1, 1, (n_nodes, n_nodes))
+    con = (con + con.T) / 2
+    node_names = [f"N{i}_{'R' if i % 2 else 'L'}_1" for i in range(n_nodes)]
+    return con, node_names
+
+
+def measure(func, repeat=3, memory=True):
+    """
+    Run ``func`` ``repeat`` times and report the best wall time and the peak memory.
+
+    The peak traced memory (``tracemalloc``) is taken from one additional run, so that
+    tracing overhead does not distort the timings.
+
+    Returns:
+    -------
+    dict
+        ``seconds`` (best wall time) and ``peak_mb`` (None if ``memory`` is False).
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        finally:
+            tracemalloc.stop()
+    return dict(seconds=best, peak_mb=peak)
@@ -0,0 +1,414 @@
+"""Header-only catalog of the cohort recordings, indexed in SQLite.
+
+Recordings are located once, their headers and trigger metadata are read without decoding
+the signal data, and the results are stored in a local SQLite database. Later stages query
+the catalog instead of crawling the filesystem and opening every recording.
+
+Supported inputs
+----------------
+- NIRx recordings (``*.nirs`` next to a ``*.hdr`` header): sampling rate and events are
+  parsed from the text header (or the ``*.evt`` file), the duration from the line count
+  of the ``*.wl1`` data file.
+- Homer ``*.nirs`` files without a NIRx header: only the ``t`` and ``s`` variables are read.
+- ``*.snirf`` files (requires h5py): only the time vector and the stimulus groups are read.
+
+Usage
+-----
+    catalog = Catalog('results/catalog.sqlite')
+    catalog.refresh(['../data_hc', '../data_mdd'], n_jobs=8)
+    for rec in catalog.recordings(group='HC'):
+        onsets = catalog.onsets(rec['path'], '10 Hz')
+"""
+import fnmatch
+import glob
+import hashlib
+import os
+import os.path as op
+import pathlib
+import re
+import sqlite3
+import time
+
+import numpy as np
+
+from config import EVENT_CODES, RECORDING_PATTERNS
+from instrument import span
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    path TEXT PRIMARY KEY,
+    format TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    subject TEXT,
+    grp TEXT,
+    sfreq REAL,
+    duration REAL,
+    scanned_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    path TEXT NOT NULL REFERENCES recordings(path) ON DELETE CASCADE,
+    condition TEXT NOT NULL,
+    code REAL,
+    onset REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_path ON events(path);
+CREATE INDEX IF NOT EXISTS events_condition ON events(condition);
+CREATE INDEX IF NOT EXISTS recordings_group ON recordings(grp, subject);
+"""
+
+_CONDITIONS = {float(code): name for name, code in EVENT_CODES.items()}
+
+
+def _condition_name(code):
+    try:
+        return _CONDITIONS.get(float(code), str(code))
+    except (TypeError, ValueError):
+        return str(code)
+
+
+def _as_float(code):
+    try:
+        return float(code)
+    except (TypeError, ValueError):
+        return None
+
+
+def file_hash(filepaths, n_bytes=2 ** 16):
+    """
+    BLAKE2b digest of the size, first and last ``n_bytes`` of each file.
+
+    Only the ends of large data files are read, which detects truncated or rewritten files
+    without reading whole recordings.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for filepath in filepaths:
+        size = os.path.getsize(filepath)
+        digest.update(f"{op.basename(filepath)}:{size}".encode())
+        with open(filepath, 'rb') as fid:
+            digest.update(fid.read(n_bytes))
+            if size > 2 * n_bytes:
+                fid.seek(-n_bytes, os.SEEK_END)
+                digest.update(fid.read(n_bytes))
+            elif size > n_bytes:
+                digest.update(fid.read())
+    return digest.hexdigest()
+
+
+def _count_lines(filepath, chunk_size=2 ** 20):
+    n_lines = 0
+    with open(filepath, 'rb') as fid:
+        for chunk in iter(lambda: fid.read(chunk_size), b''):
+            n_lines += chunk.count(b'\n')
+    return n_lines
+
+
+def _sibling(filepath, extension):
+    matches = sorted(glob.glob(op.join(glob.escape(op.dirname(filepath)), f'*{extension}')))
+    return matches[0] if matches else None
+
+
+def read_nirx_header(hdr_file):
+    """
+    Read sampling rate, duration and events of a NIRx recording from its text files.
+
+    Returns:
+    -------
+    dict
+        ``sfreq``, ``duration`` (None if the ``.wl1`` file is missing) and ``events``, a
+        list of ``(onset in s, trigger code)`` tuples.
+    """
+    with open(hdr_file, encoding='latin-1') as fid:
+        header = fid.read()
+
+    match = re.search(r'^\s*SamplingRate\s*=\s*([\d.]+)', header, re.MULTILINE)
+    if match is None:
+        raise ValueError(f"No sampling rate found in '{hdr_file}'.")
+    sfreq = float(match.group(1))
+
+    events = []
+    match = re.search(r'^\s*Events\s*=\s*"#(.*?)#"', header, re.MULTILINE | re.DOTALL)
+    if match is not None:
+        for line in match.group(1).strip().splitlines():
+            fields = line.split()
+            if len(fields) >= 2:
+                events.append((float(fields[0]), float(fields[1])))
+
+    if not events:
+        # older recordings keep the triggers in the .evt file: frame, then the trigger bits
+        evt_file = _sibling(hdr_file, '.evt')
+        if evt_file is not None:
+            with open(evt_file) as fid:
+                for line in fid:
+                    fields = line.split()
+                    if len(fields) >= 2:
+                        bits = [int(b) for b in fields[1:]]
+                        code = sum(bit << i for i, bit in enumerate(bits))
+                        events.append((int(fields[0]) / sfreq, float(code)))
+
+    wl1_file = _sibling(hdr_file, '.wl1')
+    duration = _count_lines(wl1_file) / sfreq if wl1_file is not None else None
+    return dict(sfreq=sfreq, duration=duration, events=events)
+
+
+def read_homer_header(nirs_file):
+    """
+    Read sampling rate, duration and events from the ``t`` and ``s`` variables of a Homer
+    ``.nirs`` file, without loading the data matrix.
+    """
+    from scipy.io import loadmat
+
+    mat = loadmat(nirs_file, variable_names=['t', 's', 'CondNames'])
+    times = np.ravel(mat['t'])
+    sfreq = 1.0 / np.median(np.diff(times))
+    duration = float(times[-1] - times[0] + 1.0 / sfreq)
+
+    stim = np.atleast_2d(mat.get('s', np.zeros((len(times), 0))))
+    if stim.shape[0] != len(times):
+        stim = stim.T
+    names = [str(np.ravel(n)[0]) for n in np.ravel(mat['CondNames'])] if 'CondNames' in mat else None
+
+    events = []
+    for col in range(stim.shape[1]):
+        code = names[col] if names is not None else col + 1
+        events.extend((float(times[i]), code) for i in np.flatnonzero(stim[:, col]))
+    return dict(sfreq=float(sfreq), duration=duration, events=events)
+
+
+def read_snirf_header(snirf_file):
+    """
+    Read sampling rate, duration and events of a SNIRF file, without loading the data.
+    """
+    import h5py
+
+    with h5py.File(snirf_file, 'r') as fid:
+        nirs = fid['nirs'] if 'nirs' in fid else fid['nirs1']
+        times = np.ravel(nirs['data1/time'][()])
+        if len(times) == 2:
+            # compressed time vector: start and step
+            n_times = nirs['data1/dataTimeSeries'].shape[0]
+            sfreq = 1.0 / times[1]
+        else:
+            n_times = len(times)
+            sfreq = 1.0 / np.median(np.diff(times))
+
+        events = []
+        for key in sorted(k for k in nirs if k.startswith('stim')):
+            name = nirs[key]['name'][()]
+            name = name.decode() if isinstance(name, bytes) else str(name)
+            data = np.atleast_2d(nirs[key]['data'][()])
+            events.extend((float(onset), name) for onset in data[:, 0] if data.size)
+    return dict(sfreq=float(sfreq), duration=n_times / sfreq, events=events)
+
+
+def read_header(filepath):
+    """
+    Read the header metadata of a recording, choosing the reader by file type.
+
+    Returns:
+    -------
+    dict
+        ``format``, ``sfreq``, ``duration`` and ``events``.
+    """
+    if filepath.endswith('.snirf'):
+        return dict(format='snirf', **read_snirf_header(filepath))
+    hdr_file = _sibling(filepath, '.hdr')
+    if hdr_file is not None:
+        return dict(format='nirx', **read_nirx_header(hdr_file))
+    return dict(format='homer', **read_homer_header(filepath))
+
+
+def subject_from_path(filepath):
+    """
+    Subject identifier, i.e. the recording directory name up to the first comma.
+    """
+    return op.basename(op.dirname(filepath)).split(',')[0]
+
+
+def group_from_path(filepath):
+    """
+    Group label from the innermost ``data_<group>`` directory in the path (e.g.
+    ``/mnt/data_store/data_hc/P01/NIRS.nirs`` -> HC), None if there is none.
+    """
+    for part in reversed(pathlib.Path(filepath).parent.parts):
+        match = re.fullmatch(r'data_([A-Za-z0-9]+)', part)
+        if match:
+            return match.group(1).upper()
+    return None
+
+
+def find_recordings(roots, patterns=RECORDING_PATTERNS):
+    """
+    Recursively list recording files below the given directories.
+    """
+    found = []
+    for root in roots:
+        for dirpath, _, filenames in os.walk(root):
+            for fname in filenames:
+                if any(fnmatch.fnmatch(fname, pattern) for pattern in patterns):
+                    found.append(op.abspath(op.join(dirpath, fname)))
+    return sorted(found)
+
+
+def source_files(filepath):
+    """
+    The files the metadata of a recording is read from: the recording itself and, for
+    NIRx recordings, the header, event and data files next to it.
+    """
+    files = [filepath]
+    if not filepath.endswith('.snirf'):
+        files += [sibling for sibling in (_sibling(filepath, ext) for ext in ('.hdr', '.evt', '.wl1'))
+                  if sibling is not None]
+    return files
+
+
+def _stat(filepath):
+    """
+    Change signature of a recording: the total size and latest modification time of its
+    source files.
+    """
+    stats = [os.stat(fname) for fname in source_files(filepath)]
+    return sum(st.st_size for st in stats), max(st.st_mtime_ns for st in stats)
+
+
+def _scan(filepath):
+    size = mtime_ns = digest = header = error = None
+    try:
+        size, mtime_ns = _stat(filepath)
+        digest = file_hash(source_files(filepath))
+        header = read_header(filepath)
+    except Exception as err:
+        header, error = None, f"{type(err).__name__}: {err}"
+    return dict(path=filepath, size=size, mtime_ns=mtime_ns, hash=digest, header=header, error=error)
+
+
+class Catalog:
+    """
+    SQLite index of recording metadata.
+
+    Parameters:
+    ----------
+    filepath : str
+        Path of the SQLite database; created if it does not exist.
+    """
+
+    def __init__(self, filepath):
+        if op.dirname(filepath):
+            os.makedirs(op.dirname(filepath), exist_ok=True)
+        self.filepath = filepath
+        self.conn = sqlite3.connect(filepath)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    @span('catalog.refresh')
+    def refresh(self, roots, patterns=RECORDING_PATTERNS, n_jobs=4, group=None):
+        """
+        Bring the catalog up to date with the recordings below ``roots``.
+
+        Only new files and files whose size or modification time changed are read (for NIRx
+        recordings including the header, event and data files next to them); entries
+        of files that no longer exist below ``roots`` are removed. Headers are read in
+        parallel worker threads.
+
+        Parameters:
+        ----------
+        roots : list of str
+            Directories to scan recursively.
+        patterns : sequence of str
+            File name patterns of the recordings.
+        n_jobs : int
+            Number of worker threads, -1 for one per CPU.
+        group : str | None
+            Group label for all scanned files; if None it is derived from the path
+            (see ``group_from_path``).
+
+        Returns:
+        -------
+        dict
+            Lists of ``added``, ``updated``, ``removed`` and ``failed`` paths.
+        """
+        from preprocessing import map_recordings
+
+        roots = [op.abspath(root) for root in roots]
+        files = find_recordings(roots, patterns)
+        known = {row['path']: (row['size'], row['mtime_ns'])
+                 for row in self.conn.execute('SELECT path, size, mtime_ns FROM recordings')}
+
+        to_scan = []
+        for filepath in files:
+            try:
+                signature = _stat(filepath)
+            except OSError:
+                signature = None  # deleted meanwhile; the scan reports it as failed
+            if signature is None or known.get(filepath) != signature:
+                to_scan.append(filepath)
+
+        scanned = map_recordings(_scan, to_scan, n_jobs=n_jobs)
+
+        summary = dict(added=[], updated=[], removed=[], failed=[])
+        present = set(files)
+        with self.conn:
+            for filepath in known:
+                if filepath not in present and any(filepath.startswith(op.join(root, '')) for root in roots):
+                    self.conn.execute('DELETE FROM recordings WHERE path = ?', (filepath,))
+                    summary['removed'].append(filepath)
+
+            for rec in scanned:
+                if rec['error'] is not None:
+                    summary['failed'].append(rec['path'])
+                    continue
+                header = rec['header']
+                self.conn.execute('DELETE FROM recordings WHERE path = ?', (rec['path'],))
+                self.conn.execute(
+                    'INSERT INTO recordings (path, format, size, mtime_ns, hash, subject, grp, sfreq, duration, '
+                    'scanned_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (rec['path'], header['format'], rec['size'], rec['mtime_ns'], rec['hash'],
+                     subject_from_path(rec['path']), group or group_from_path(rec['path']),
+                     header['sfreq'], header['duration'], time.time()))
+                self.conn.executemany(
+                    'INSERT INTO events (path, condition, code, onset) VALUES (?, ?, ?, ?)',
+                    [(rec['path'], _condition_name(code), _as_float(code), onset)
+                     for onset, code in header['events']])
+                summary['updated' if rec['path'] in known else 'added'].append(rec['path'])
+        return summary
+
+    def recordings(self, group=None, subject=None):
+        """
+        Catalog entries as dictionaries, optionally filtered by group and subject.
+        """
+        query, params = 'SELECT * FROM recordings WHERE 1=1', []
+        if group is not None:
+            query += ' AND grp = ?'
+            params.append(group.upper())
+        if subject is not None:
+            query += ' AND subject = ?'
+            params.append(subject)
+        return [dict(row) for row in self.conn.execute(query + ' ORDER BY path', params)]
+
+    def onsets(self, filepath, condition):
+        """
+        Event onsets (in s) of a condition (e.g. ``'10 Hz'``) in a recording.
+        """
+        rows = self.conn.execute('SELECT onset FROM events WHERE path = ? AND condition = ? ORDER BY onset',
+                                 (op.abspath(filepath), condition))
+        return np.array([row['onset'] for row in rows])
+
+    def events(self, filepath):
+        """
+        All events of a recording as ``(onset, condition)`` tuples, in temporal order.
+        """
+        rows = self.conn.execute('SELECT onset, condition FROM events WHERE path = ? ORDER BY onset',
+                                 (op.abspath(filepath),))
+        return [(row['onset'], row['condition']) for row in rows]
@@ -1,4 +1,33 @@
-from mne.viz.utils import mne_analyze_colormap, plt_show
+try:
+    from instrument import span as _span
+except ImportError:  # used standalone, without the rest of this repository
+    from contextlib import ContextDecorator
+
+    class _span(ContextDecorator):
+        def __init__(self, name):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+# number of connections above which rasterize_edges="auto" rasterizes the edge layer
+_AUTO_RASTERIZE_EDGES = 1000
+
+
+def _plt_show(show=True, block=None):
+    """
+    Show the current figures unless a non-interactive backend is in use.
+
+    Equivalent to ``mne.viz.utils.plt_show``, kept local so this module does not need MNE.
+    """
+    import matplotlib
+    import matplotlib.pyplot as plt
+
+    if show and matplotlib.get_backend().lower() != "agg":
+        plt.show(block=block)
 
 
 def _get_cmap(colormap, lut=None):
@@ -20,6 +49,9 @@ def _get_cmap(colormap, lut=None):
     if colormap is None:
         colormap = rcParams["image.cmap"]
     if isinstance(colormap, str) and colormap in ("mne", "mne_analyze"):
+        # only this colormap needs MNE, import it on demand
+        from mne.viz.utils import mne_analyze_colormap
+
         colormap = mne_analyze_colormap([0, 1, 2], format="matplotlib")
     elif not isinstance(colormap, colors.Colormap):
         colormap = get_cmap(colormap)
@@ -28,6 +60,7 @@ def _get_cmap(colormap, lut=None):
     return colormap
 
 
+@_span("plot_connectivity_circle")
 def plot_connectivity_circle(
         con,
         node_names,
@@ -58,6 +91,9 @@ def plot_connectivity_circle(
         interactive=True,
         node_linewidth=2.0,
         show=True,
+        rasterize_edges=False,
+        edge_lod_threshold=None,
+        edge_lod_bins=8,
 ):
     """Visualize connectivity as a circular graph.
 
@@ -140,6 +176,19 @@ def plot_connectivity_circle(
         Line with for nodes.
     show : bool
         Show figure if True.
+    rasterize_edges : bool | "auto"
+        If True, the connections are drawn as a single rasterized layer while
+        nodes, labels and the colorbar stay vector graphics, which keeps SVG
+        and PDF output small for many connections. If "auto", the connections
+        are rasterized when more than ``edge_lod_threshold`` (or 1000 if None)
+        are drawn.
+    edge_lod_threshold : int | None
+        If not None and more connections are drawn, only the
+        ``edge_lod_threshold`` strongest connections are drawn individually.
+        The weaker ones are binned by color into ``edge_lod_bins`` rasterized,
+        alpha-blended density layers.
+    edge_lod_bins : int
+        Number of density layers used for the weak connections.
 
     Returns
     -------
@@ -161,11 +210,13 @@ def plot_connectivity_circle(
     If ``facecolor`` is not set via :func:`matplotlib.pyplot.savefig`, the
     figure labels, title, and legend may be cut off in the output figure.
     """
-    import matplotlib.pyplot as plt
+    import numpy as np
 
-    from mne_connectivity.base import BaseConnectivity
+    import matplotlib.pyplot as plt
 
-    if isinstance(con, BaseConnectivity):
+    # Connectivity objects (e.g. from mne_connectivity) are recognised by duck-typing,
+    # so that importing this module does not pull in MNE
+    if not isinstance(con, np.ndarray) and callable(getattr(con, "get_data", None)):
         con = con.get_data()
 
     if fig is not None or subplot is not None:
@@ -203,6 +254,9 @@ def plot_connectivity_circle(
         ax=ax,
         node_linewidth=node_linewidth,
         show=show,
+        rasterize_edges=rasterize_edges,
+        edge_lod_threshold=edge_lod_threshold,
+        edge_lod_bins=edge_lod_bins,
     )
 
 
@@ -233,11 +287,15 @@ def _plot_connectivity_circle(
         ax=None,
         node_linewidth=2.0,
         show=True,
+        rasterize_edges=False,
+        edge_lod_threshold=None,
+        edge_lod_bins=8,
 ):
     from itertools import cycle
 
     import numpy as np
 
+    import matplotlib.collections as m_collections
     import matplotlib.patches as m_patches
     import matplotlib.path as m_path
     import matplotlib.pyplot as plt
@@ -341,66 +399,114 @@ def _plot_connectivity_circle(
         vmax = np.max(con)
     vrange = vmax - vmin
 
-    # We want to add some "noise" to the start and end position of the
-    # edges: We modulate the noise with the number of connections of the
-    # node and the connection strength, such that the strongest connections
-    # are closer to the node center
-    nodes_n_con = np.zeros((n_nodes), dtype=np.int64)
-    for i, j in zip(indices[0], indices[1]):
-        nodes_n_con[i] += 1
-        nodes_n_con[j] += 1
-
-    # initialize random number generator so plot is reproducible
-    rng = np.random.mtrand.RandomState(0)
-
-    n_con = len(indices[0])
-    noise_max = 0.25 * node_width
-    start_noise = rng.uniform(-noise_max, noise_max, n_con)
-    end_noise = rng.uniform(-noise_max, noise_max, n_con)
-
-    nodes_n_con_seen = np.zeros_like(nodes_n_con)
-    for i, (start, end) in enumerate(zip(indices[0], indices[1])):
-        nodes_n_con_seen[start] += 1
-        nodes_n_con_seen[end] += 1
-
-        start_noise[i] *= (nodes_n_con[start] - nodes_n_con_seen[start]) / float(
-            nodes_n_con[start]
-        )
-        end_noise[i] *= (nodes_n_con[end] - nodes_n_con_seen[end]) / float(
-            nodes_n_con[end]
-        )
-
-    # scale connectivity for colormap (vmin<=>0, vmax<=>1)
-    con_val_scaled = (con - vmin) / vrange
-
-    # Finally, we draw the connections
-    for pos, (i, j) in enumerate(zip(indices[0], indices[1])):
-        # Start point
-        t0, r0 = node_angles[i], 10
-
-        # End point
-        t1, r1 = node_angles[j], 10
-
-        # Some noise in start and end point
-        t0 += start_noise[pos]
-        t1 += end_noise[pos]
-
-        verts = [(t0, r0), (t0, 5), (t1, 5), (t1, r1)]
-        codes = [
-            m_path.Path.MOVETO,
-            m_path.Path.CURVE4,
-            m_path.Path.CURVE4,
-            m_path.Path.LINETO,
-        ]
-        path = m_path.Path(verts, codes)
-
-        color = colormap(con_val_scaled[pos])
-
-        # Actual line
-        patch = m_patches.PathPatch(
-            path, fill=False, edgecolor=color, linewidth=linewidth, alpha=1.0
-        )
-        ax.add_patch(patch)
+    with _span("circle.edge_paths"):
+        # We want to add some "noise" to the start and end position of the
+        # edges: We modulate the noise with the number of connections of the
+        # node and the connection strength, such that the strongest connections
+        # are closer to the node center
+        nodes_n_con = np.zeros((n_nodes), dtype=np.int64)
+        for i, j in zip(indices[0], indices[1]):
+            nodes_n_con[i] += 1
+            nodes_n_con[j] += 1
+
+        # initialize random number generator so plot is reproducible
+        rng = np.random.mtrand.RandomState(0)
+
+        n_con = len(indices[0])
+        noise_max = 0.25 * node_width
+        start_noise = rng.uniform(-noise_max, noise_max, n_con)
+        end_noise = rng.uniform(-noise_max, noise_max, n_con)
+
+        nodes_n_con_seen = np.zeros_like(nodes_n_con)
+        for i, (start, end) in enumerate(zip(indices[0], indices[1])):
+            nodes_n_con_seen[start] += 1
+            nodes_n_con_seen[end] += 1
+
+            start_noise[i] *= (nodes_n_con[start] - nodes_n_con_seen[start]) / float(
+                nodes_n_con[start]
+            )
+            end_noise[i] *= (nodes_n_con[end] - nodes_n_con_seen[end]) / float(
+                nodes_n_con[end]
+            )
+
+        # scale connectivity for colormap (vmin<=>0, vmax<=>1)
+        con_val_scaled = (con - vmin) / vrange
+
+        # Finally, we draw the connections
+        paths = []
+        for pos, (i, j) in enumerate(zip(indices[0], indices[1])):
+            # Start point
+            t0, r0 = node_angles[i], 10
+
+            # End point
+            t1, r1 = node_angles[j], 10
+
+            # Some noise in start and end point
+            t0 += start_noise[pos]
+            t1 += end_noise[pos]
+
+            verts = [(t0, r0), (t0, 5), (t1, 5), (t1, r1)]
+            codes = [
+                m_path.Path.MOVETO,
+                m_path.Path.CURVE4,
+                m_path.Path.CURVE4,
+                m_path.Path.LINETO,
+            ]
+            paths.append(m_path.Path(verts, codes))
+
+    with _span("circle.draw_edges"):
+        # Level of detail: above edge_lod_threshold connections only the strongest ones are
+        # drawn individually, the weaker ones are binned by color into density layers
+        n_weak = 0
+        if edge_lod_threshold is not None and n_con > edge_lod_threshold:
+            n_weak = n_con - edge_lod_threshold
+
+        if rasterize_edges == "auto":
+            rasterize_edges = n_con > (
+                edge_lod_threshold if edge_lod_threshold is not None else _AUTO_RASTERIZE_EDGES
+            )
+
+        if n_weak > 0:
+            # connections are sorted by strength, so the weak ones come first
+            weak_val = np.clip(con_val_scaled[:n_weak], 0.0, 1.0)
+            weak_bins = np.minimum((weak_val * edge_lod_bins).astype(int), edge_lod_bins - 1)
+            weak_strength = np.abs(con[:n_weak]) / max(np.max(np.abs(con)), np.finfo(float).tiny)
+            for b in np.unique(weak_bins):
+                in_bin = np.flatnonzero(weak_bins == b)
+                # weaker layers are more transparent, overlapping edges blend into density
+                alpha = 0.1 + 0.5 * float(np.mean(weak_strength[in_bin]))
+                layer = m_collections.PathCollection(
+                    [paths[k] for k in in_bin],
+                    facecolors="none",
+                    edgecolors=[colormap((b + 0.5) / edge_lod_bins)],
+                    linewidths=linewidth,
+                    alpha=alpha,
+                    transform=ax.transData,
+                )
+                layer.set_rasterized(True)
+                ax.add_collection(layer, autolim=False)
+
+        if rasterize_edges or n_weak > 0:
+            # one collection for all remaining edges, so it can be rasterized as a single layer
+            edges = m_collections.PathCollection(
+                paths[n_weak:],
+                facecolors="none",
+                edgecolors=colormap(con_val_scaled[n_weak:]),
+                linewidths=linewidth,
+                alpha=1.0,
+                transform=ax.transData,
+            )
+            edges.set_rasterized(bool(rasterize_edges))
+            ax.add_collection(edges, autolim=False)
+        else:
+            for pos, path in enumerate(paths):
+                color = colormap(con_val_scaled[pos])
+
+                # Actual line
+                patch = m_patches.PathPatch(
+                    path, fill=False, edgecolor=color, linewidth=linewidth, alpha=1.0
+                )
+                ax.add_patch(patch)
 
     # Draw ring with colored nodes
     height = np.ones(n_nodes) * node_height
@@ -457,5 +563,5 @@ def _plot_connectivity_circle(
         cb.ax.tick_params(labelsize=fontsize_colorbar)
         plt.setp(cb_yticks, color=textcolor)
 
-    plt_show(show)
+    _plt_show(show)
     return fig, ax
@@ -0,0 +1,452 @@
+"""Command-line entry point for batch processing.
+
+Usage
+-----
+    python cli.py circle --contrast MDD-HC:rs1-sham --contrast MDD-HC:10hz-sham --out results/
+    python cli.py circle --config contrasts.json --report results/report.json
+    python cli.py circle --config contrasts.json --validate-only
+    python cli.py accumulate results/hc_accumulator.npz --add sub-31 sub-31_R6.mat
+    python cli.py pack data/RSFC_GoodCH_AllSub_HC_Window5s_SCI.mat data/RSFC_GoodCH_AllSub_HC.npz --float32
+    python cli.py catalog ../data_hc ../data_mdd --jobs 8
+    python cli.py stream ../data_hc/P01/NIRS.nirs --speed 10 --fps 2 --out results/live.png
+
+Groups listed under ``accumulators`` take their condition means from a streaming
+accumulator checkpoint (see ``stats.GroupAccumulator``) instead of the group file. Group
+files ending in ``.npz`` are packed tensors written by ``pack`` (see
+``stats.ChannelMaskedTensor``).
+
+Configuration files are JSON documents; when several are given, later files override
+earlier ones. Recognised keys (all optional)::
+
+    {
+        "data_path": "data",
+        "labels": {"file": "Depth_Label.mat", "key": "Labels_1N"},
+        "groups": {"HC": "RSFC_GoodCH_AllSub_HC_Window5s_SCI.mat", "MDD": "..."},
+        "key": "R6",
+        "category_order": ["cerebelum", "..."],
+        "shift": 23,
+        "out": "results",
+        "format": "png",
+        "dpi": 300,
+        "plot": {"vmin": -0.25, "vmax": 0.25, "colormap": "RdBu_r"},
+        "accumulators": {"HC": "hc_accumulator.npz"},
+        "contrasts": ["MDD-HC:rs1-sham", {"spec": "HC:10hz-sham", "name": "hc_10hz_effect"}]
+    }
+
+``data_path`` and ``out`` are relative to the configuration file; the label, group and
+accumulator files are relative to ``data_path``.
+
+Only the standard library and NumPy are imported until the configuration has been
+validated, so ``--help`` and ``--validate-only`` return quickly; SciPy and matplotlib are
+loaded when the contrasts are processed.
+
+Set ``FNIRS_PROFILE=1`` to add per-stage timings of the loaders, statistics and plotting
+to the run report (see ``instrument.py``).
+"""
+import argparse
+import json
+import os
+import os.path as op
+import sys
+import time
+
+import config
+from instrument import span, get_profiler
+
+_PLOT_OPTIONS = ('vmin', 'vmax', 'colormap', 'n_lines', 'linewidth', 'facecolor', 'textcolor',
+                 'fontsize_names', 'fontsize_title', 'fontsize_colorbar', 'colorbar', 'padding',
+                 'rasterize_edges', 'edge_lod_threshold', 'edge_lod_bins')
+
+
+def _default_settings():
+    return dict(data_path=config.DATA_PATH,
+                labels=dict(file=config.LABELS_FILE, key=config.LABELS_KEY),
+                groups=dict(config.GROUP_FILES),
+                key=config.GROUP_KEY,
+                category_order=list(config.CATEGORY_ORDER),
+                shift=config.NODE_SHIFT,
+                out=config.RESULTS_PATH,
+                format='png',
+                dpi=300,
+                plot=dict(),
+                accumulators=dict(),
+                contrasts=[])
+
+
+_SETTING_TYPES = dict(data_path=str, out=str, format=str, key=str, dpi=int, shift=int, category_order=list,
+                      contrasts=list, labels=dict, groups=dict, plot=dict, accumulators=dict)
+
+
+def _check_type(key, value, fname):
+    expected = _SETTING_TYPES[key]
+    names = {str: 'a string', int: 'an integer', list: 'a JSON array', dict: 'a JSON object'}
+    # bool is a subclass of int, but 'true' is not a valid dpi or shift
+    if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+        raise ValueError(f"'{key}' in configuration file '{fname}' must be {names[expected]}.")
+    if key == 'category_order' and not all(isinstance(item, str) for item in value):
+        raise ValueError(f"'category_order' in configuration file '{fname}' must be a list of strings.")
+
+
+def load_settings(config_files):
+    """
+    Merge JSON configuration files on top of the defaults from ``config.py``.
+
+    Nested ``labels``, ``groups``, ``plot`` and ``accumulators`` sections are merged key by key, all other
+    keys are replaced. ``data_path`` and ``out`` are resolved against the configuration file's
+    directory; the label, group and accumulator files are relative to ``data_path``.
+
+    Raises:
+    ------
+    ValueError
+        If a file cannot be parsed, or has an unknown key or a value of the wrong type.
+    """
+    settings = _default_settings()
+    for fname in config_files:
+        try:
+            with open(fname) as fid:
+                content = json.load(fid)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"The file '{fname}' was not found.")
+        except json.JSONDecodeError as err:
+            raise ValueError(f"Could not parse configuration file '{fname}': {err}")
+        if not isinstance(content, dict):
+            raise ValueError(f"Configuration file '{fname}' must contain a JSON object.")
+
+        for key, value in content.items():
+            if key not in settings:
+                raise ValueError(f"Unknown key '{key}' in configuration file '{fname}'.")
+            _check_type(key, value, fname)
+
+        base_dir = op.dirname(op.abspath(fname))
+        for key in ('data_path', 'out'):
+            if key in content:
+                content[key] = op.join(base_dir, content[key])
+        for key, value in content.items():
+            if key in ('labels', 'groups', 'plot', 'accumulators'):
+                settings[key].update(value)
+            else:
+                settings[key] = value
+    return settings
+
+
+def resolve_contrasts(settings):
+    """
+    Validate the requested contrasts without touching any data.
+
+    Returns:
+    -------
+    list of dict
+        Parsed contrasts with an additional ``name`` and ``spec`` key each.
+
+    Raises:
+    ------
+    ValueError
+        If a contrast is malformed, refers to an unknown group or condition, or two
+        contrasts would be written to the same file.
+    """
+    from contrasts import parse_contrast, contrast_name
+
+    if not settings['contrasts']:
+        raise ValueError("No contrasts requested, use --contrast or a configuration file.")
+
+    groups = {group.upper() for group in list(settings['groups']) + list(settings['accumulators'])}
+    resolved = []
+    names = set()
+    for entry in settings['contrasts']:
+        if isinstance(entry, str):
+            entry = dict(spec=entry)
+        if not isinstance(entry, dict) or 'spec' not in entry:
+            raise ValueError(f"Invalid contrast entry {entry!r}, expected a string or an object with 'spec'.")
+        contrast = parse_contrast(entry['spec'])
+        for group in (contrast['group'], contrast['reference']):
+            if group is not None and group not in groups:
+                raise ValueError(f"Unknown group '{group}' in contrast '{entry['spec']}', "
+                                 f"expected one of {', '.join(sorted(groups))}.")
+        contrast.update(spec=entry['spec'], name=entry.get('name') or contrast_name(contrast))
+        if contrast['name'] in names:
+            raise ValueError(f"Duplicate contrast name '{contrast['name']}'.")
+        names.add(contrast['name'])
+        resolved.append(contrast)
+
+    unknown = set(settings['plot']) - set(_PLOT_OPTIONS)
+    if unknown:
+        raise ValueError(f"Unknown plot option(s): {', '.join(sorted(unknown))}.")
+    return resolved
+
+
+class _Timer:
+    """Collect named wall-clock timings for the run report."""
+
+    def __init__(self):
+        self.timings = {}
+
+    def __call__(self, name):
+        return _Span(self.timings, name)
+
+
+class _Span:
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + time.perf_counter() - self.start
+        return False
+
+
+def run_circle(settings, contrasts, verbose=False):
+    """
+    Compute and save a connectivity circle plot for each contrast.
+
+    Group tensors, condition means, node order and colors are computed once and shared
+    between contrasts. A failing contrast is recorded in the report and does not stop the
+    remaining ones.
+
+    Returns:
+    -------
+    dict
+        The run report.
+    """
+    timer = _Timer()
+
+    with timer('import'):
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+
+        from contrasts import GroupMeans, hemisphere_order, load_node_labels, region_colors, reorder_matrix, \
+            plot_contrast
+
+    with timer('load_labels'):
+        node_labels = load_node_labels(op.join(settings['data_path'], settings['labels']['file']),
+                                       settings['labels']['key'])
+        order = hemisphere_order(node_labels, settings['category_order'], settings['shift'])
+        node_names = [node_labels[i] for i in order]
+        node_colors, _ = region_colors(node_names)
+
+    means = GroupMeans(settings['groups'], settings['key'], settings['data_path'],
+                       accumulators=settings['accumulators'])
+    os.makedirs(settings['out'], exist_ok=True)
+
+    results = []
+    for contrast in contrasts:
+        name = contrast['name']
+        fname = op.join(settings['out'], f"{name}.{settings['format']}")
+        result = dict(name=name, spec=contrast['spec'], output=fname, status='ok', timings={})
+        ctimer = _Timer()
+        try:
+            with ctimer('compute'):
+                mat = reorder_matrix(means.contrast(contrast), order)
+            with ctimer('plot'):
+                fig, _ = plot_contrast(mat, node_names, node_colors, show=False, **settings['plot'])
+            with ctimer('save'), span('savefig'):
+                fig.savefig(fname, dpi=settings['dpi'])
+                plt.close(fig)
+        except Exception as err:
+            result.update(status='error', error=f"{type(err).__name__}: {err}")
+        result['timings'] = ctimer.timings
+        results.append(result)
+        if verbose:
+            print(f"{name}: {result['status']} ({sum(ctimer.timings.values()):.2f} s)", file=sys.stderr)
+
+    report = dict(timings=timer.timings, contrasts=results)
+    if get_profiler() is not None:
+        report['spans'] = get_profiler().report()
+    return report
+
+
+def _circle(args):
+    started, start = time.time(), time.perf_counter()
+    settings = load_settings(args.config)
+    if args.contrast:
+        settings['contrasts'] = list(args.contrast)
+    for key in ('data_path', 'out', 'format', 'dpi'):
+        value = getattr(args, key)
+        if value is not None:
+            settings[key] = value
+    contrasts = resolve_contrasts(settings)
+
+    if args.validate_only:
+        for contrast in contrasts:
+            print(f"{contrast['name']}: {contrast['spec']}")
+        return 0
+
+    report = run_circle(settings, contrasts, verbose=args.verbose)
+    report.update(command='circle',
+                  started=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)),
+                  total_seconds=time.perf_counter() - start)
+
+    if args.report == '-':
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    elif args.report is not None:
+        with open(args.report, 'w') as fid:
+            json.dump(report, fid, indent=2)
+
+    return 1 if any(result['status'] != 'ok' for result in report['contrasts']) else 0
+
+
+def _load_subject(fname, key):
+    from utils import load_mat_file
+
+    data = load_mat_file(fname, key)
+    # single-subject files may keep the leading subject axis
+    if data.ndim == 4 and data.shape[0] == 1:
+        data = data[0]
+    if data.ndim != 3:
+        raise ValueError(f"Expected a (conditions x channels x channels) matrix in '{fname}', got shape {data.shape}.")
+    return data
+
+
+def _accumulate(args):
+    from stats import GroupAccumulator
+    from utils import load_mat_file
+
+    if args.init is not None:
+        if op.exists(args.checkpoint):
+            raise ValueError(f"The checkpoint '{args.checkpoint}' already exists.")
+        acc = GroupAccumulator.from_tensor(load_mat_file(args.init, args.key))
+    else:
+        acc = GroupAccumulator.load(args.checkpoint)
+
+    for subject, fname in args.remove:
+        acc.remove_subject(subject, _load_subject(fname, args.key))
+    for subject, fname in args.add:
+        acc.add_subject(subject, _load_subject(fname, args.key))
+
+    acc.save(args.checkpoint)
+    print(f"{args.checkpoint}: {len(acc.subjects)} subjects")
+    return 0
+
+
+def _pack(args):
+    import numpy as np
+
+    from stats import ChannelMaskedTensor
+    from utils import load_mat_file
+
+    tensor = ChannelMaskedTensor.from_nan(load_mat_file(args.input, args.key),
+                                          dtype=np.float32 if args.float32 else None)
+    tensor.save(args.output)
+    print(f"{args.output}: {tensor.shape}, {tensor.nbytes / 1e6:.1f} MB")
+    return 0
+
+
+def _catalog(args):
+    from catalog import Catalog
+
+    with Catalog(args.database) as catalog:
+        summary = catalog.refresh(args.roots, n_jobs=args.jobs, group=args.group)
+        n_total = len(catalog.recordings())
+    for path in summary['failed']:
+        print(f"failed: {path}", file=sys.stderr)
+    print(f"{args.database}: {n_total} recordings ({len(summary['added'])} added, {len(summary['updated'])} updated, "
+          f"{len(summary['removed'])} removed, {len(summary['failed'])} failed)")
+    return 1 if summary['failed'] else 0
+
+
+def _stream(args):
+    import asyncio
+
+    from streaming import CircleFrames, FileReplayer, StreamingConnectivity, run_stream
+
+    if not op.exists(args.recording):
+        raise FileNotFoundError(f"The file '{args.recording}' was not found.")
+    source = FileReplayer.from_file(args.recording, chunk_duration=args.chunk, speed=args.speed)
+    processor = StreamingConnectivity(source.sfreq, len(source.ch_names), window=args.window,
+                                      distances=source.distances, wavelengths=source.wavelengths,
+                                      decimate_to=args.decimate)
+    plotter = None
+    if args.out is not None:
+        plotter = CircleFrames(processor.node_names(source.ch_names), filepath=args.out)
+
+    report = asyncio.run(run_stream(source, processor, plotter, max_fps=args.fps))
+    report.update(command='stream', recording=args.recording, speed=args.speed)
+    if args.report is not None:
+        with open(args.report, 'w') as fid:
+            json.dump(report, fid, indent=2)
+    processing = report['processing'] or {}
+    print(f"{args.recording}: {report['chunks']} chunks, {report['frames']} frames "
+          f"({report['skipped_frames']} skipped), processing p95 {processing.get('p95_ms', float('nan')):.1f} ms")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='fnirs-sandbox', description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    circle = subparsers.add_parser('circle', help='Plot group connectivity contrasts as circle graphs.')
+    circle.add_argument('--config', action='append', default=[], metavar='FILE',
+                        help='JSON configuration file (can be given several times).')
+    circle.add_argument('--contrast', action='append', metavar='SPEC',
+                        help="Contrast as 'GROUP[-REFERENCE]:CONDITION[-BASELINE]', e.g. 'MDD-HC:rs1-sham' "
+                             "(can be given several times, overrides the configuration files).")
+    circle.add_argument('--out', default=None, help='Output directory for the figures.')
+    circle.add_argument('--data-path', dest='data_path', default=None, help='Directory with the input .mat files.')
+    circle.add_argument('--format', default=None, help='Figure file format (png, svg, pdf, ...).')
+    circle.add_argument('--dpi', type=int, default=None, help='Figure resolution.')
+    circle.add_argument('--report', default=None, metavar='FILE',
+                        help="Write a JSON run report with timings to FILE ('-' for stdout).")
+    circle.add_argument('--validate-only', action='store_true',
+                        help='Check the configuration and contrasts without loading any data.')
+    circle.add_argument('-v', '--verbose', action='store_true')
+    circle.set_defaults(func=_circle)
+
+    accumulate = subparsers.add_parser('accumulate',
+                                       help='Add or remove subjects from a streaming group accumulator.')
+    accumulate.add_argument('checkpoint', help='Accumulator checkpoint (.npz), updated in place.')
+    accumulate.add_argument('--init', default=None, metavar='FILE',
+                            help='Create the checkpoint from an all-subjects group file.')
+    accumulate.add_argument('--add', nargs=2, action='append', default=[], metavar=('SUBJECT', 'FILE'),
+                            help='Fold in a subject result file (can be given several times).')
+    accumulate.add_argument('--remove', nargs=2, action='append', default=[], metavar=('SUBJECT', 'FILE'),
+                            help='Remove a previously added subject (can be given several times).')
+    accumulate.add_argument('--key', default=config.GROUP_KEY, help='Key of the result matrix in the files.')
+    accumulate.set_defaults(func=_accumulate)
+
+    pack = subparsers.add_parser('pack', help='Store a group result tensor with packed good-channel masks (.npz).')
+    pack.add_argument('input', help='Group result file (.mat) with NaN rows/columns for rejected channels.')
+    pack.add_argument('output', help='Packed tensor file (.npz), usable as a group file.')
+    pack.add_argument('--key', default=config.GROUP_KEY, help='Key of the result tensor in the input file.')
+    pack.add_argument('--float32', action='store_true', help='Store the values in single precision.')
+    pack.set_defaults(func=_pack)
+
+    catalog = subparsers.add_parser('catalog', help='Index recording headers and events in a SQLite catalog.')
+    catalog.add_argument('roots', nargs='+', help='Directories to scan recursively.')
+    catalog.add_argument('--database', default=config.CATALOG_PATH, help='SQLite catalog file.')
+    catalog.add_argument('--group', default=None, help='Group label (default: from data_<group> in the path).')
+    catalog.add_argument('-j', '--jobs', type=int, default=4, help='Number of worker threads.')
+    catalog.set_defaults(func=_catalog)
+
+    stream = subparsers.add_parser('stream', help='Replay a recording through the real-time connectivity pipeline.')
+    stream.add_argument('recording', help='Recording to replay (.nirs header/.snirf file).')
+    stream.add_argument('--speed', type=float, default=1.0,
+                        help="Replay speed relative to real time ('inf' for as fast as possible).")
+    stream.add_argument('--chunk', type=float, default=1.0, help='Chunk duration in s.')
+    stream.add_argument('--window', type=float, default=60.0, help='Connectivity window in s.')
+    stream.add_argument('--decimate', type=float, default=None, metavar='SFREQ',
+                        help='Decimate the connectivity signals to about SFREQ Hz after the SCI.')
+    stream.add_argument('--fps', type=float, default=2.0, help='Maximum circle plot refresh rate.')
+    stream.add_argument('--out', default=None, help='Image file the latest frame is written to.')
+    stream.add_argument('--report', default=None, metavar='FILE', help='Write the latency report to FILE.')
+    stream.set_defaults(func=_stream)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except (ValueError, KeyError, FileNotFoundError) as err:
+        print(f"error: {err}", file=sys.stderr)
+        return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -18,3 +18,39 @@ sources_and_detector_names = dict(S1='AF7', S2='Fpz', S3='AF8', S4='AF3', S5='AF
                                   D26='P1', D27='P2', D28='PO3', D29='PO4', D30='Oz')
 
 DATA_PATH = op.join(pathlib.Path(__file__).parent.resolve(), "data")
+
+# conditions stored along the second axis of the R6 result tensors
+CONDITIONS = ('rs0', 'sham', '2hz', '10hz', '25hz', '40hz', 'rs1')
+
+# group-level result files (subjects x conditions x channels x channels)
+GROUP_FILES = dict(HC='RSFC_GoodCH_AllSub_HC_Window5s_SCI.mat',
+                   MDD='RSFC_GoodCH_AllSub_MDD_Window5s_SCI.mat')
+GROUP_KEY = 'R6'
+
+# probe structure labeling file
+LABELS_FILE = 'Depth_Label.mat'
+LABELS_KEY = 'Labels_1N'
+
+# order of brain regions around the circle and rotation of the node ring
+CATEGORY_ORDER = ('cerebelum', 'occipital', 'lingual', 'temporal', 'supramarginal',
+                  'calcarine', 'parietal', 'precuneus', 'postcentral', 'motor', 'precentral', 'frontal')
+NODE_SHIFT = 23
+
+RESULTS_PATH = op.join(pathlib.Path(__file__).parent.resolve(), "results")
+
+# trigger codes of the stimulation conditions in the raw recordings
+EVENT_CODES = {'Resting State': 0, 'Sham': 1, '2 Hz': 2, '10 Hz': 3, '25 Hz': 4, '40 Hz': 5}
+
+# recording file patterns and the cohort catalog index
+RECORDING_PATTERNS = ('*.nirs', '*.snirf')
+CATALOG_PATH = op.join(pathlib.Path(__file__).parent.resolve(), "results", "catalog.sqlite")
+
+# duration (s) of each stimulation block following its trigger
+BLOCK_DURATION = 360.0
+
+# frequency bands (Hz) of the spectral connectivity; the stimulation frequencies lie above
+# the Nyquist frequency of the recordings, so bands cover the slow hemodynamic oscillations
+SPECTRAL_BANDS = {'slow5': (0.01, 0.027), 'slow4': (0.027, 0.073), 'slow3': (0.073, 0.198)}
+
+# sampling frequency (Hz) recordings are decimated to after the cardiac-band quality metrics
+DECIMATED_SFREQ = 2.0
@@ -0,0 +1,282 @@
+import os.path as op
+import re
+
+import numpy as np
+
+from instrument import span
+from utils import load_mat_file, load_labels_from_mat, add_occurrence_suffix, get_category_order, shift_list
+from config import CONDITIONS, CATEGORY_ORDER, NODE_SHIFT
+
+# contrast specification, e.g. "MDD-HC:rs1-sham" or "HC:10hz"
+_CONTRAST_RE = re.compile(r'^\s*(?P<groups>[^:]+?)\s*:\s*(?P<conditions>[^:]+?)\s*$')
+
+
+def parse_contrast(spec, conditions=CONDITIONS):
+    """
+    Parse a contrast specification of the form ``GROUP[-REFERENCE]:CONDITION[-BASELINE]``.
+
+    Parameters:
+    ----------
+    spec : str
+        The contrast specification, e.g. ``"MDD-HC:rs1-sham"`` for the difference between
+        the (rs1 - sham) effect in MDD and in HC, or ``"HC:10hz"`` for a plain group mean.
+    conditions : sequence of str
+        The valid condition names, in the order they are stored in the result tensor.
+
+    Returns:
+    -------
+    dict
+        A dictionary with the keys ``group``, ``reference``, ``condition`` and ``baseline``
+        (``reference`` and ``baseline`` are None if not given).
+
+    Raises:
+    ------
+    ValueError
+        If the specification is malformed or names an unknown condition.
+    """
+    match = _CONTRAST_RE.match(spec)
+    if match is None:
+        raise ValueError(f"Invalid contrast '{spec}', expected 'GROUP[-REFERENCE]:CONDITION[-BASELINE]'.")
+
+    groups = match.group('groups').split('-')
+    conds = [cond.lower() for cond in match.group('conditions').split('-')]
+    if len(groups) > 2 or len(conds) > 2 or not all(groups) or not all(conds):
+        raise ValueError(f"Invalid contrast '{spec}', expected 'GROUP[-REFERENCE]:CONDITION[-BASELINE]'.")
+
+    for cond in conds:
+        if cond not in conditions:
+            raise ValueError(f"Unknown condition '{cond}' in contrast '{spec}', "
+                             f"expected one of {', '.join(conditions)}.")
+
+    return dict(group=groups[0].upper(),
+                reference=groups[1].upper() if len(groups) == 2 else None,
+                condition=conds[0],
+                baseline=conds[1] if len(conds) == 2 else None)
+
+
+def contrast_name(contrast):
+    """
+    Build a file-name friendly name for a parsed contrast, e.g. ``"mdd-hc_rs1-sham"``.
+    """
+    groups = '-'.join(g for g in (contrast['group'], contrast['reference']) if g)
+    conds = '-'.join(c for c in (contrast['condition'], contrast['baseline']) if c)
+    return f"{groups.lower()}_{conds}"
+
+
+@span('hemisphere_order')
+def hemisphere_order(node_labels, category_order=CATEGORY_ORDER, shift_amount=NODE_SHIFT):
+    """
+    Compute the display order of the nodes on the connectivity circle.
+
+    Left hemisphere labels are placed first (categories in reverse order), followed by the
+    right hemisphere labels, so that both hemispheres are displayed symmetrically. The
+    resulting order is then rotated by ``shift_amount`` positions.
+
+    Parameters:
+    ----------
+    node_labels : list of str
+        Node labels with occurrence suffixes (see ``add_occurrence_suffix``).
+    category_order : sequence of str
+        Brain region categories in the order they should appear.
+    shift_amount : int
+        Number of positions to rotate the node ring by (negative for left shift).
+
+    Returns:
+    -------
+    list of int
+        Indices into ``node_labels`` in display order.
+    """
+    category_order = list(category_order)
+
+    # Identify indices of right and left hemispheric labels
+    r_indices = [i for i, item in enumerate(node_labels) if '_R_' in item]
+    l_indices = [i for i, item in enumerate(node_labels) if '_L_' in item]
+
+    # Sort indices by category, grouping similar names together
+    r_indices_sorted = sorted(r_indices, key=lambda x: (get_category_order(node_labels[x], category_order),
+                                                        node_labels[x].split('_1')[0]))
+    l_indices_sorted = sorted(l_indices, key=lambda x: (get_category_order(node_labels[x], category_order, -1),
+                                                        node_labels[x].split('_1')[0]))
+
+    # Combine left and right indices and rotate the ring; this is equivalent to rolling
+    # the rows and columns of the reordered matrix by the same amount
+    return shift_list(l_indices_sorted + r_indices_sorted, shift_amount)
+
+
+@span('reorder_matrix')
+def reorder_matrix(mat, order):
+    """
+    Reorder rows and columns of a square connectivity matrix in a single indexing step.
+    """
+    return mat[np.ix_(order, order)]
+
+
+def load_node_labels(filepath, key):
+    """
+    Load the channel depth labels and make them unique by adding occurrence suffixes.
+    """
+    depth_labels = load_labels_from_mat(filepath, key)
+    return add_occurrence_suffix(depth_labels[:, 1])
+
+
+class GroupMeans:
+    """
+    Lazily load group result tensors and cache the subject-averaged condition matrices.
+
+    Each group tensor is read at most once and each (group, condition) mean is computed at
+    most once, so that many contrasts can be evaluated in one run without reloading data.
+
+    Parameters:
+    ----------
+    group_files : dict
+        Mapping of group name to the .mat file holding its result tensor.
+    key : str
+        The key of the tensor (subjects x conditions x channels x channels) in the files.
+    data_path : str
+        Directory the group files are relative to.
+    conditions : sequence of str
+        Condition names in the order they are stored along the second tensor axis.
+    accumulators : dict | None
+        Mapping of group name to a ``stats.GroupAccumulator`` checkpoint. Means and
+        variances of these groups are read from the checkpoint instead of the group file.
+    """
+
+    def __init__(self, group_files, key, data_path, conditions=CONDITIONS, accumulators=None):
+        self.group_files = {group.upper(): fname for group, fname in group_files.items()}
+        self.key = key
+        self.data_path = data_path
+        self.conditions = tuple(conditions)
+        self.accumulators = {group.upper(): fname for group, fname in (accumulators or {}).items()}
+        self._tensors = {}
+        self._accumulators = {}
+        self._means = {}
+
+    @classmethod
+    def from_tensors(cls, tensors, conditions=CONDITIONS):
+        """
+        Build from group tensors that are already in memory, keyed by group name. Tensors
+        may be NaN-masked arrays or ``stats.ChannelMaskedTensor`` instances.
+        """
+        means = cls({group: None for group in tensors}, None, None, conditions)
+        means._tensors.update({group.upper(): tensor for group, tensor in tensors.items()})
+        return means
+
+    def tensor(self, group):
+        """
+        The result tensor of a group: a NaN-masked array for .mat group files, or a
+        ``stats.ChannelMaskedTensor`` for packed .npz files (see ``cli.py pack``).
+        """
+        if group not in self.group_files:
+            raise KeyError(f"Unknown group '{group}', expected one of {', '.join(self.group_files)}.")
+        if group not in self._tensors:
+            fname = op.join(self.data_path, self.group_files[group])
+            if fname.endswith('.npz'):
+                from stats import ChannelMaskedTensor
+
+                self._tensors[group] = ChannelMaskedTensor.load(fname)
+            else:
+                self._tensors[group] = load_mat_file(fname, self.key)
+        return self._tensors[group]
+
+    def accumulator(self, group):
+        """
+        The streaming accumulator of a group, or None if the group has no checkpoint.
+        """
+        if group not in self.accumulators:
+            return None
+        if group not in self._accumulators:
+            from stats import GroupAccumulator
+
+            self._accumulators[group] = GroupAccumulator.load(op.join(self.data_path, self.accumulators[group]))
+        return self._accumulators[group]
+
+    def mean(self, group, condition):
+        if (group, condition) not in self._means:
+            acc = self.accumulator(group)
+            if acc is not None:
+                self._means[group, condition] = acc.mean(condition)
+            else:
+                tensor = self.tensor(group)
+                if isinstance(tensor, np.ndarray):
+                    idx = self.conditions.index(condition)
+                    with span('nanmean'):
+                        self._means[group, condition] = np.nanmean(tensor[:, idx, :, :], axis=0)
+                else:
+                    self._means[group, condition] = tensor.mean(condition)
+        return self._means[group, condition]
+
+    def variance(self, group, condition, ddof=1):
+        acc = self.accumulator(group)
+        if acc is not None:
+            return acc.var(condition, ddof=ddof)
+        tensor = self.tensor(group)
+        if isinstance(tensor, np.ndarray):
+            idx = self.conditions.index(condition)
+            return np.nanvar(tensor[:, idx, :, :], axis=0, ddof=ddof)
+        return tensor.var(condition, ddof=ddof)
+
+    def effect(self, group, condition, baseline=None):
+        mat = self.mean(group, condition)
+        if baseline is not None:
+            mat = mat - self.mean(group, baseline)
+        return mat
+
+    @span('contrast')
+    def contrast(self, contrast):
+        """
+        Compute the connectivity matrix for a parsed contrast (see ``parse_contrast``).
+        """
+        mat = self.effect(contrast['group'], contrast['condition'], contrast['baseline'])
+        if contrast['reference'] is not None:
+            mat = mat - self.effect(contrast['reference'], contrast['condition'], contrast['baseline'])
+        return mat
+
+
+def region_colors(node_names, colormap='tab20'):
+    """
+    Assign one color per brain region, where the region is the node name without its
+    hemisphere and occurrence suffixes.
+
+    Returns:
+    -------
+    node_colors : list
+        The color of each node.
+    colors : dict
+        Mapping of region name to color.
+    """
+    from circular import _get_cmap
+
+    base_names = ['_'.join(name.split('_')[:-2]) for name in node_names]
+    unique_base_names = sorted(set(base_names))
+
+    color_map = _get_cmap(colormap, lut=len(unique_base_names))
+    colors = {base_name: color_map(i) for i, base_name in enumerate(unique_base_names)}
+    return [colors[base_name] for base_name in base_names], colors
+
+
+@span('plot_contrast')
+def plot_contrast(mat, node_names, node_colors, ax=None, **kwargs):
+    """
+    Plot a reordered connectivity matrix as a circle graph using the project defaults.
+
+    Additional keyword arguments are passed on to ``plot_connectivity_circle``.
+    """
+    import matplotlib.pyplot as plt
+
+    from circular import plot_connectivity_circle
+
+    if ax is None:
+        _, ax = plt.subplots(figsize=(10, 10), facecolor="white", subplot_kw=dict(polar=True))
+
+    plot_kwargs = dict(colorbar_pos=(0.5, 1.5),
+                       colormap='RdBu_r',
+                       vmin=-0.25, vmax=0.25,
+                       facecolor='white',
+                       textcolor='black')
+    plot_kwargs.update(kwargs)
+
+    return plot_connectivity_circle(mat,
+                                    node_names=node_names,
+                                    node_colors=node_colors,
+                                    ax=ax,
+                                    **plot_kwargs)
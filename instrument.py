@@ -0,0 +1,237 @@
+"""Lightweight stage-level instrumentation.
+
+Spans are enabled with the ``FNIRS_PROFILE`` environment variable and cost a single
+attribute lookup when it is unset:
+
+- ``FNIRS_PROFILE=1`` records wall time, CPU time and resident set size (RSS): how much a
+  span raised the process's RSS high-water mark (``rss_growth_mb``, zero unless the span
+  set a new peak) and the high-water mark at its end (``process_max_rss_mb``),
+- ``FNIRS_PROFILE=memory`` additionally records the peak ``tracemalloc`` allocation of
+  each span (slower, use for memory investigations only). This is the per-stage memory
+  measure; the RSS values cannot attribute memory to a stage that stays below an
+  earlier peak.
+
+If ``FNIRS_PROFILE_OUT`` is set to a path prefix, ``<prefix>.json`` and ``<prefix>.folded``
+(collapsed stacks for flamegraph.pl / speedscope) are written when the process exits.
+
+Usage
+-----
+    from instrument import span
+
+    with span('nanmean'):
+        mean = np.nanmean(tensor, axis=0)
+
+    @span('load_mat_file')
+    def load_mat_file(filepath, key):
+        ...
+"""
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+
+class _Stats:
+    __slots__ = ('calls', 'wall', 'cpu', 'child_wall', 'process_max_rss_mb', 'rss_growth_mb', 'peak_mb')
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.child_wall = 0.0
+        self.process_max_rss_mb = None
+        self.rss_growth_mb = None
+        self.peak_mb = None
+
+
+class Profiler:
+    """
+    Collect nested span statistics, aggregated by their stack path.
+
+    Parameters:
+    ----------
+    memory : bool
+        Also trace Python allocations with ``tracemalloc`` and record the peak per span.
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.stats = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def enter(self, name):
+        stack = self._stack()
+        path = f"{stack[-1]['path']};{name}" if stack else name
+        frame = dict(path=path, wall=time.perf_counter(), cpu=time.process_time(), child_wall=0.0,
+                     rss=_max_rss_mb())
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]['mem_max'] = max(stack[-1]['mem_max'], peak)
+            tracemalloc.reset_peak()
+            frame.update(mem_start=current, mem_max=current)
+        stack.append(frame)
+
+    def exit(self):
+        wall_end, cpu_end = time.perf_counter(), time.process_time()
+        stack = self._stack()
+        if not stack:  # profiling was enabled inside an open span
+            return
+        frame = stack.pop()
+        wall = wall_end - frame['wall']
+        if stack:
+            stack[-1]['child_wall'] += wall
+
+        peak_mb = None
+        if self.memory:
+            peak = max(frame['mem_max'], tracemalloc.get_traced_memory()[1])
+            peak_mb = (peak - frame['mem_start']) / 1024 ** 2
+            if stack:
+                stack[-1]['mem_max'] = max(stack[-1]['mem_max'], peak)
+
+        rss = _max_rss_mb()
+        with self._lock:
+            stats = self.stats.get(frame['path'])
+            if stats is None:
+                stats = self.stats[frame['path']] = _Stats()
+            stats.calls += 1
+            stats.wall += wall
+            stats.cpu += cpu_end - frame['cpu']
+            stats.child_wall += frame['child_wall']
+            if rss is not None:
+                stats.process_max_rss_mb = max(stats.process_max_rss_mb or 0.0, rss)
+                stats.rss_growth_mb = max(stats.rss_growth_mb or 0.0, rss - frame['rss'])
+            if peak_mb is not None:
+                stats.peak_mb = max(stats.peak_mb or 0.0, peak_mb)
+
+    def report(self):
+        """
+        Span statistics as a list of dictionaries, one per stack path.
+        """
+        with self._lock:
+            return [dict(path=path, name=path.rsplit(';', 1)[-1], calls=s.calls, wall_seconds=s.wall,
+                         self_seconds=s.wall - s.child_wall, cpu_seconds=s.cpu,
+                         rss_growth_mb=s.rss_growth_mb, process_max_rss_mb=s.process_max_rss_mb,
+                         peak_tracemalloc_mb=s.peak_mb)
+                    for path, s in self.stats.items()]
+
+    def write_json(self, filepath):
+        with open(filepath, 'w') as fid:
+            json.dump(dict(spans=self.report()), fid, indent=2)
+
+    def write_folded(self, filepath):
+        """
+        Write collapsed stacks (``a;b;c <self time in microseconds>``) for flame graphs.
+        """
+        with open(filepath, 'w') as fid:
+            for rec in self.report():
+                fid.write(f"{rec['path']} {max(int(round(rec['self_seconds'] * 1e6)), 0)}\n")
+
+    def reset(self):
+        with self._lock:
+            self.stats.clear()
+
+
+class _Span:
+    """Context manager and decorator recording one span on the active profiler."""
+
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if _profiler is not None:
+            _profiler.enter(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        if _profiler is not None:
+            _profiler.exit()
+        return False
+
+    def __call__(self, func):
+        name = self.name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            _profiler.enter(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _profiler.exit()
+
+        return wrapper
+
+
+def span(name):
+    """
+    Record a named stage, usable as ``with span(name):`` or as ``@span(name)``.
+
+    Nothing is recorded unless profiling is enabled (see ``enable``).
+    """
+    return _Span(name)
+
+
+def enable(memory=False):
+    """
+    Start recording spans, returns the active ``Profiler``.
+    """
+    global _profiler
+    _profiler = Profiler(memory=memory)
+    return _profiler
+
+
+def disable():
+    """
+    Stop recording spans, returns the profiler that was active (or None).
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def get_profiler():
+    return _profiler
+
+
+def _write_at_exit(prefix):
+    if _profiler is not None and _profiler.stats:
+        _profiler.write_json(f"{prefix}.json")
+        _profiler.write_folded(f"{prefix}.folded")
+
+
+_profiler = None
+_mode = os.environ.get('FNIRS_PROFILE', '').strip().lower()
+if _mode and _mode not in ('0', 'false', 'no', 'off'):
+    enable(memory=_mode == 'memory')
+    if os.environ.get('FNIRS_PROFILE_OUT'):
+        atexit.register(_write_at_exit, os.environ['FNIRS_PROFILE_OUT'])
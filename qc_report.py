@@ -0,0 +1,230 @@
+"""Cohort quality-control report with one reusable figure.
+
+Each subject is drawn into the same figure and axes: a trigger raster, a histogram of the
+scalp coupling index (SCI) and the channel x window SCI matrix as a single ``imshow``
+raster with the channels below threshold overlaid. Only the artists' data is updated
+between subjects, instead of creating (and closing) three figures per recording.
+
+The panels of all subjects are collected into one self-contained HTML report with a
+summary table.
+
+Usage
+-----
+    report = QCReport(threshold=0.5)
+    for file in files:
+        ...
+        report.add(subject, sci=sci, scores=scores, times=times, events=events, sfreq=sfreq)
+    report.write_html('results/qc_report.html')
+"""
+import base64
+import html
+import io
+
+import numpy as np
+
+from config import EVENT_CODES
+from instrument import span
+
+
+class QCReport:
+    """
+    Render per-subject QC panels into one reused figure and collect them into a report.
+
+    Parameters:
+    ----------
+    threshold : float
+        SCI threshold below which channels (or windows) are marked as bad.
+    event_codes : dict
+        Mapping of condition name to trigger code, used to label the trigger raster.
+    figsize : tuple
+        Size of the figure in inches.
+    dpi : int
+        Resolution of the rendered panels.
+    n_bins : int
+        Number of SCI histogram bins between 0 and 1.
+    """
+
+    def __init__(self, threshold=0.5, event_codes=EVENT_CODES, figsize=(16, 9), dpi=100, n_bins=20):
+        self.threshold = threshold
+        self.event_codes = dict(event_codes)
+        self.figsize = figsize
+        self.dpi = dpi
+        self.bin_edges = np.linspace(0, 1, n_bins + 1)
+        self.entries = []
+        self._fig = None
+
+    def _setup(self):
+        """Create the figure, axes and artists once; later subjects only update data."""
+        import matplotlib
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        fig = Figure(figsize=self.figsize, dpi=self.dpi, layout='constrained')
+        FigureCanvasAgg(fig)
+        grid = fig.add_gridspec(2, 2, width_ratios=(1, 2), height_ratios=(1, 1))
+        ax_events = fig.add_subplot(grid[0, 0])
+        ax_hist = fig.add_subplot(grid[1, 0])
+        ax_matrix = fig.add_subplot(grid[:, 1])
+
+        # trigger raster
+        codes = sorted(self.event_codes.values())
+        self._code_rows = {code: row for row, code in enumerate(codes)}
+        names = {code: name for name, code in self.event_codes.items()}
+        self._events = ax_events.scatter([], [], c=[], cmap='tab10', vmin=0, vmax=9, s=30)
+        ax_events.set(yticks=range(len(codes)), yticklabels=[names[code] for code in codes],
+                      ylim=(-0.5, len(codes) - 0.5), xlabel='Time (s)', title='Triggers')
+
+        # SCI histogram with fixed bins
+        widths = np.diff(self.bin_edges)
+        self._bars = ax_hist.bar(self.bin_edges[:-1], np.zeros(len(widths)), width=widths, align='edge',
+                                 color='0.6', edgecolor='k')
+        self._hist_threshold = ax_hist.axvline(self.threshold, color='r', linestyle='--')
+        ax_hist.set(xlim=(0, 1), xlabel='Scalp Coupling Index', ylabel='Count', title='SCI')
+
+        # channel x window SCI matrix, with a translucent overlay of the windows below threshold
+        cmap = matplotlib.colormaps['RdYlGn']
+        self._matrix = ax_matrix.imshow(np.zeros((1, 1)), cmap=cmap, vmin=0, vmax=1, aspect='auto',
+                                        interpolation='nearest', origin='upper')
+        self._overlay = ax_matrix.imshow(np.zeros((1, 1, 4)), aspect='auto', interpolation='nearest',
+                                         origin='upper')
+        fig.colorbar(self._matrix, ax=ax_matrix, label='Scalp Coupling Index', shrink=0.8)
+        ax_matrix.set(xlabel='Time (s)', ylabel='Channel')
+
+        self._fig, self._axes = fig, (ax_events, ax_hist, ax_matrix)
+
+    @span('qc_report.render')
+    def render(self, title, sci=None, scores=None, times=None, events=None, sfreq=None, ch_names=None):
+        """
+        Draw one subject into the shared figure and return it as PNG bytes.
+
+        Parameters:
+        ----------
+        title : str
+            Panel title, e.g. the subject and file name.
+        sci : numpy.ndarray, shape (n_channels,) | None
+            Scalp coupling index of each channel.
+        scores : numpy.ndarray, shape (n_channels, n_windows) | None
+            Windowed scalp coupling index.
+        times : numpy.ndarray, shape (n_windows,) | None
+            Start time of each window in s.
+        events : numpy.ndarray, shape (n_events, 3) | None
+            MNE-style events (sample, 0, code).
+        sfreq : float | None
+            Sampling frequency, needed to convert event samples to seconds.
+        ch_names : list of str | None
+            Channel names for the matrix rows (only shown for up to 60 channels).
+        """
+        if self._fig is None:
+            self._setup()
+        ax_events, ax_hist, ax_matrix = self._axes
+
+        # triggers
+        if events is not None and len(events):
+            events = np.asarray(events)
+            onsets = events[:, 0] / sfreq
+            rows = np.array([self._code_rows.get(code, -1) for code in events[:, 2]])
+            self._events.set_offsets(np.column_stack((onsets, rows)))
+            self._events.set_array(rows.astype(float))
+            ax_events.set_xlim(-0.05 * onsets.max() - 1, 1.05 * onsets.max() + 1)
+        else:
+            self._events.set_offsets(np.empty((0, 2)))
+            self._events.set_array(np.empty(0))
+            ax_events.set_xlim(0, 1)
+
+        # histogram
+        counts = np.zeros(len(self._bars))
+        if sci is not None:
+            counts, _ = np.histogram(np.clip(sci, 0, 1), bins=self.bin_edges)
+        for bar, count in zip(self._bars, counts):
+            bar.set_height(count)
+        ax_hist.set_ylim(0, max(1, counts.max()) * 1.1)
+
+        # windowed SCI matrix
+        if scores is not None:
+            scores = np.asarray(scores)
+            n_ch, n_win = scores.shape
+            if times is not None and len(times) > 1:
+                step = times[1] - times[0]
+                extent = (times[0], times[-1] + step, n_ch - 0.5, -0.5)
+            else:
+                extent = (0, n_win, n_ch - 0.5, -0.5)
+            self._matrix.set_data(scores)
+            overlay = np.zeros(scores.shape + (4,))
+            overlay[scores < self.threshold] = (0, 0, 0, 0.45)
+            self._overlay.set_data(overlay)
+            for image in (self._matrix, self._overlay):
+                image.set_extent(extent)
+            # labels are passed in both cases, so that the names of a previous subject are
+            # not left on the reused axis
+            if ch_names is not None and n_ch <= 60:
+                ax_matrix.set_yticks(range(n_ch), ch_names, fontsize=6)
+            else:
+                ticks = np.linspace(0, n_ch - 1, min(n_ch, 10)).round().astype(int)
+                ax_matrix.set_yticks(ticks, [str(tick) for tick in ticks], fontsize=10)
+            ax_matrix.set_title(f"Windowed SCI (bad: < {self.threshold})")
+        else:
+            # blank the matrix, otherwise the previous subject's scores stay on the figure
+            self._matrix.set_data(np.full((1, 1), np.nan))
+            self._overlay.set_data(np.zeros((1, 1, 4)))
+            for image in (self._matrix, self._overlay):
+                image.set_extent((-0.5, 0.5, 0.5, -0.5))
+            ax_matrix.set_yticks([])
+            ax_matrix.set_title('')
+
+        self._fig.suptitle(title)
+        buffer = io.BytesIO()
+        self._fig.savefig(buffer, format='png', dpi=self.dpi)
+        return buffer.getvalue()
+
+    def add(self, subject, title=None, **kwargs):
+        """
+        Render a subject (see ``render`` for the keyword arguments) and add it to the report.
+        """
+        png = self.render(title or subject, **kwargs)
+
+        summary = dict(subject=subject)
+        sci = kwargs.get('sci')
+        if sci is not None:
+            sci = np.asarray(sci)
+            summary.update(n_channels=len(sci), n_bad=int(np.sum(sci < self.threshold)),
+                           median_sci=float(np.median(sci)))
+        scores = kwargs.get('scores')
+        if scores is not None:
+            summary.update(bad_windows=float(np.mean(np.asarray(scores) < self.threshold)))
+        self.entries.append(dict(summary=summary, png=png))
+        return png
+
+    @span('qc_report.write_html')
+    def write_html(self, filepath, title='fNIRS quality control'):
+        """
+        Write all subjects into a single self-contained HTML file.
+        """
+        rows, panels = [], []
+        for entry in self.entries:
+            s = entry['summary']
+            anchor = html.escape(s['subject'])
+            cells = [f'<a href="#{anchor}">{anchor}</a>',
+                     str(s.get('n_channels', '')),
+                     str(s.get('n_bad', '')),
+                     f"{s['median_sci']:.2f}" if 'median_sci' in s else '',
+                     f"{100 * s['bad_windows']:.1f} %" if 'bad_windows' in s else '']
+            rows.append('<tr>' + ''.join(f'<td>{cell}</td>' for cell in cells) + '</tr>')
+            image = base64.b64encode(entry['png']).decode('ascii')
+            panels.append(f'<h2 id="{anchor}">{anchor}</h2>\n<img src="data:image/png;base64,{image}" '
+                          f'alt="{anchor}" style="max-width:100%">')
+
+        with open(filepath, 'w') as fid:
+            fid.write(f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{html.escape(title)}</title>
+<style>body{{font-family:sans-serif}} td,th{{padding:2px 10px;text-align:right}}</style></head>
+<body><h1>{html.escape(title)}</h1>
+<table><tr><th>Subject</th><th>Channels</th><th>SCI &lt; {self.threshold}</th><th>Median SCI</th>
+<th>Bad windows</th></tr>
+{chr(10).join(rows)}
+</table>
+{chr(10).join(panels)}
+</body></html>
+""")
+
+    def close(self):
+        self._fig = None
@@ -0,0 +1,230 @@
+"""Frequency-resolved connectivity between all channel pairs.
+
+Cross-spectral densities are estimated with Welch's method: overlapping segments share
+one window and are transformed with batched FFTs, and the cross-spectra of all channel
+pairs are accumulated per frequency bin with one matrix product per batch of segments.
+Segments are processed in batches, so memory is bounded by the batch size and does not
+grow with the recording length.
+
+From the cross-spectra, coherence, imaginary coherence and the phase locking value (PLV)
+are computed per frequency bin and averaged within each band. Cohort results are arranged
+like the ``R6`` tensors (subjects x conditions x channels x channels), one per measure and
+band, and can be used with ``contrasts.GroupMeans`` directly.
+
+Usage
+-----
+    blocks = split_blocks(hbo, sfreq, onsets)  # one array per condition
+    con = band_connectivity(blocks[0], sfreq)
+    tensors = connectivity_tensors([blocks_sub1, blocks_sub2], sfreq, n_jobs=-1)
+    plv_slow4 = tensors['plv']['slow4']
+"""
+import numpy as np
+
+from config import BLOCK_DURATION, CONDITIONS, SPECTRAL_BANDS
+from instrument import span
+
+MEASURES = ('coh', 'imcoh', 'plv')
+
+
+def split_blocks(data, sfreq, onsets, duration=BLOCK_DURATION):
+    """
+    Cut a recording into its stimulation blocks.
+
+    Parameters:
+    ----------
+    data : numpy.ndarray, shape (n_channels, n_times)
+        The signals.
+    sfreq : float
+        Sampling frequency in Hz.
+    onsets : sequence of float | None
+        Onset of each block in s, in condition order; None for missing blocks.
+    duration : float
+        Duration of each block in s.
+
+    Returns:
+    -------
+    list of numpy.ndarray | None
+        Views into ``data``, one per block.
+    """
+    n_samples = int(round(duration * sfreq))
+    blocks = []
+    for onset in onsets:
+        if onset is None:
+            blocks.append(None)
+            continue
+        start = int(round(onset * sfreq))
+        blocks.append(data[:, start:start + n_samples])
+    return blocks
+
+
+@span('spectral.cross_spectra')
+def cross_spectra(data, sfreq, fmin=0.0, fmax=np.inf, seg_duration=100.0, overlap=0.5, batch_size=16):
+    """
+    Welch cross-spectral densities and phase-normalized cross-spectra of all channel pairs.
+
+    Parameters:
+    ----------
+    data : numpy.ndarray, shape (n_channels, n_times)
+        The signals.
+    sfreq : float
+        Sampling frequency in Hz.
+    fmin, fmax : float
+        Range of the frequency bins to keep.
+    seg_duration : float
+        Segment length in s; determines the frequency resolution (1 / seg_duration).
+    overlap : float
+        Fraction of overlap between consecutive segments.
+    batch_size : int
+        Number of segments transformed at once.
+
+    Returns:
+    -------
+    freqs : numpy.ndarray, shape (n_freqs,)
+        The frequency bins.
+    csd : numpy.ndarray, shape (n_freqs, n_channels, n_channels), complex
+        Cross-spectral density averaged over segments (unscaled).
+    phase : numpy.ndarray, shape (n_freqs, n_channels, n_channels), complex
+        Average of the cross-spectra normalized to unit magnitude.
+    """
+    from scipy.signal import get_window
+
+    data = np.asarray(data)
+    n_channels, n_times = data.shape
+    n_per_seg = min(int(round(seg_duration * sfreq)), n_times)
+    step = max(1, n_per_seg - int(overlap * n_per_seg))
+    starts = np.arange(0, n_times - n_per_seg + 1, step)
+
+    window = get_window('hann', n_per_seg)
+    freqs = np.fft.rfftfreq(n_per_seg, 1 / sfreq)
+    keep = (freqs >= fmin) & (freqs <= fmax)
+    freqs = freqs[keep]
+
+    csd = np.zeros((len(freqs), n_channels, n_channels), dtype=np.complex128)
+    phase = np.zeros_like(csd)
+    offsets = np.arange(n_per_seg)
+    for first in range(0, len(starts), batch_size):
+        # (segments, channels, samples), detrended and windowed
+        segments = data[:, starts[first:first + batch_size, None] + offsets].transpose(1, 0, 2)
+        segments = segments - segments.mean(axis=-1, keepdims=True)
+        segments *= window
+
+        # (freqs, channels, segments)
+        spectra = np.fft.rfft(segments, axis=-1)[..., keep].transpose(2, 1, 0)
+        csd += spectra @ spectra.conj().transpose(0, 2, 1)
+
+        # bins with zero power have no phase; NaN spectra (rejected channels) stay NaN
+        magnitude = np.abs(spectra)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            unit = np.where(magnitude == 0, 0, spectra / magnitude)
+        phase += unit @ unit.conj().transpose(0, 2, 1)
+
+    csd /= len(starts)
+    phase /= len(starts)
+    return freqs, csd, phase
+
+
+def band_connectivity(data, sfreq, bands=SPECTRAL_BANDS, measures=MEASURES, **kwargs):
+    """
+    Coherence, imaginary coherence and PLV of all channel pairs, averaged within bands.
+
+    Parameters:
+    ----------
+    data : numpy.ndarray, shape (n_channels, n_times)
+        The signals, e.g. HbO of one stimulation block.
+    sfreq : float
+        Sampling frequency in Hz.
+    bands : dict
+        Mapping of band name to (fmin, fmax) in Hz.
+    measures : sequence of str
+        Any of 'coh', 'imcoh' and 'plv'.
+    **kwargs
+        Passed on to ``cross_spectra``.
+
+    Returns:
+    -------
+    dict
+        Mapping of measure to an array of shape (n_bands, n_channels, n_channels), bands in
+        the order of ``bands``.
+    """
+    unknown = set(measures) - set(MEASURES)
+    if unknown:
+        raise ValueError(f"Unknown measures {sorted(unknown)}, expected any of {', '.join(MEASURES)}.")
+
+    limits = np.array(list(bands.values()), dtype=float)
+    freqs, csd, phase = cross_spectra(data, sfreq, fmin=limits[:, 0].min(), fmax=limits[:, 1].max(), **kwargs)
+
+    power = np.real(np.diagonal(csd, axis1=1, axis2=2))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        norm = np.sqrt(power[:, :, None] * power[:, None, :])
+        per_freq = dict(coh=lambda: np.abs(csd) / norm, imcoh=lambda: csd.imag / norm, plv=lambda: np.abs(phase))
+
+    results = {}
+    for measure in measures:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values = per_freq[measure]()
+        out = np.empty((len(bands),) + values.shape[1:])
+        for i, (name, (fmin, fmax)) in enumerate(bands.items()):
+            in_band = (freqs >= fmin) & (freqs < fmax)
+            if not in_band.any():
+                raise ValueError(f"No frequency bins in band '{name}' ({fmin}-{fmax} Hz); increase seg_duration.")
+            out[i] = values[in_band].mean(axis=0)
+        results[measure] = out
+    return results
+
+
+def connectivity_tensors(subjects, sfreq, bands=SPECTRAL_BANDS, measures=MEASURES, conditions=CONDITIONS,
+                         n_jobs=1, **kwargs):
+    """
+    Spectral connectivity of a cohort, in the subjects x conditions x channels x channels
+    layout of the ``R6`` tensors.
+
+    Parameters:
+    ----------
+    subjects : list of list
+        Per subject, one (n_channels, n_times) array per condition (see ``split_blocks``),
+        or None for a missing block. Rejected channels can be NaN rows.
+    sfreq : float
+        Sampling frequency in Hz.
+    bands : dict
+        Mapping of band name to (fmin, fmax) in Hz.
+    measures : sequence of str
+        Any of 'coh', 'imcoh' and 'plv'.
+    conditions : sequence of str
+        Condition names, in the order of the blocks.
+    n_jobs : int
+        Number of worker threads subjects are distributed over, -1 for one per CPU.
+    **kwargs
+        Passed on to ``cross_spectra``.
+
+    Returns:
+    -------
+    dict
+        ``tensors[measure][band]`` of shape (n_subjects, n_conditions, n_channels,
+        n_channels), NaN for missing blocks and rejected channels.
+    """
+    from preprocessing import map_recordings
+
+    subjects = [list(blocks) for blocks in subjects]
+    if any(len(blocks) != len(conditions) for blocks in subjects):
+        raise ValueError(f"Every subject needs one block per condition ({len(conditions)}).")
+    shapes = {block.shape[0] for blocks in subjects for block in blocks if block is not None}
+    if len(shapes) != 1:
+        raise ValueError("All blocks need the same (non-zero) number of channels.")
+    n_channels = shapes.pop()
+
+    shape = (len(subjects), len(conditions), n_channels, n_channels)
+    tensors = {measure: {band: np.full(shape, np.nan) for band in bands} for measure in measures}
+
+    def compute(item):
+        # each worker writes into its own subject slice of the preallocated tensors
+        idx, blocks = item
+        for cond, block in enumerate(blocks):
+            if block is None:
+                continue
+            con = band_connectivity(block, sfreq, bands=bands, measures=measures, **kwargs)
+            for measure, values in con.items():
+                for band, band_values in zip(bands, values):
+                    tensors[measure][band][idx, cond] = band_values
+
+    map_recordings(compute, enumerate(subjects), n_jobs=n_jobs)
+    return tensors
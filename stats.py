@@ -0,0 +1,443 @@
+import hashlib
+import os
+import os.path as op
+
+import numpy as np
+
+from config import CONDITIONS
+from instrument import span
+
+_CHECKPOINT_VERSION = 2
+_MASKED_VERSION = 1
+
+
+class EdgeAccumulator:
+    """
+    NaN-aware streaming mean and variance (Welford's algorithm) for every edge of a set of
+    connectivity matrices.
+
+    Matrices can be added and removed one at a time in O(edges), so that group statistics
+    do not have to be recomputed from all subjects when a single subject changes. NaN
+    entries (e.g. rejected channels) do not contribute to the edge they belong to, which
+    makes ``mean`` equivalent to ``np.nanmean`` over the added matrices.
+
+    Parameters:
+    ----------
+    shape : tuple of int
+        Shape of the matrices to accumulate, e.g. (channels, channels).
+    """
+
+    def __init__(self, shape):
+        self.count = np.zeros(shape, dtype=np.int64)
+        self._mean = np.zeros(shape, dtype=np.float64)
+        self._m2 = np.zeros(shape, dtype=np.float64)
+
+    @property
+    def shape(self):
+        return self.count.shape
+
+    def _check(self, mat):
+        mat = np.asarray(mat, dtype=np.float64)
+        if mat.shape != self.shape:
+            raise ValueError(f"Expected a matrix of shape {self.shape}, got {mat.shape}.")
+        return mat
+
+    def add(self, mat):
+        """
+        Fold a matrix into the running statistics.
+        """
+        mat = self._check(mat)
+        valid = ~np.isnan(mat)
+        self.count += valid
+
+        delta = np.where(valid, mat - self._mean, 0.0)
+        n = np.maximum(self.count, 1)
+        self._mean += delta / n
+        self._m2 += np.where(valid, delta * (mat - self._mean), 0.0)
+
+    def remove(self, mat):
+        """
+        Remove a previously added matrix from the running statistics.
+
+        Raises:
+        ------
+        ValueError
+            If an edge would end up with a negative count, i.e. the matrix was not added.
+        """
+        mat = self._check(mat)
+        valid = ~np.isnan(mat)
+        if np.any(self.count[valid] == 0):
+            raise ValueError("Cannot remove a matrix that was not added to the accumulator.")
+
+        count_old = self.count
+        self.count = count_old - valid
+
+        n = np.maximum(self.count, 1)
+        mean_old = self._mean
+        mean_new = np.where(valid, (count_old * mean_old - np.where(valid, mat, 0.0)) / n, mean_old)
+        self._m2 -= np.where(valid, (mat - mean_new) * (mat - mean_old), 0.0)
+        self._mean = mean_new
+
+        # reset edges without data, and guard against round-off below zero
+        empty = self.count == 0
+        self._mean[empty] = 0.0
+        self._m2[empty] = 0.0
+        np.maximum(self._m2, 0.0, out=self._m2)
+
+    def mean(self):
+        """
+        Mean of every edge, NaN where no data was added.
+        """
+        return np.where(self.count > 0, self._mean, np.nan)
+
+    def var(self, ddof=1):
+        """
+        Variance of every edge, NaN where fewer than ``ddof + 1`` values were added.
+        """
+        dof = self.count - ddof
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(dof > 0, self._m2 / np.maximum(dof, 1), np.nan)
+
+
+def array_digest(data):
+    """
+    BLAKE2b digest of an array's shape and float64 values (NaN normalized), used to check
+    that a removed subject is the one that was added.
+    """
+    data = np.array(data, dtype=np.float64)
+    data[np.isnan(data)] = np.nan
+    digest = hashlib.blake2b(str(data.shape).encode(), digest_size=16)
+    digest.update(data.tobytes())
+    return digest.hexdigest()
+
+
+class GroupAccumulator:
+    """
+    Per-condition edge accumulators for one group, updated one subject at a time.
+
+    Parameters:
+    ----------
+    n_channels : int
+        Number of channels of the connectivity matrices.
+    conditions : sequence of str
+        Condition names, in the order they are stored in a subject's result array.
+
+    Examples:
+    --------
+    >>> acc = GroupAccumulator.from_tensor(r6_mat_hc)  # doctest:+SKIP
+    >>> acc.add_subject('sub-31', r6_sub31)  # doctest:+SKIP
+    >>> acc.save('results/hc_accumulator.npz')  # doctest:+SKIP
+    >>> hc_sham = acc.mean('sham')  # doctest:+SKIP
+    """
+
+    def __init__(self, n_channels, conditions=CONDITIONS):
+        self.conditions = tuple(conditions)
+        self.subjects = []
+        self.digests = {}
+        self._acc = EdgeAccumulator((len(self.conditions), n_channels, n_channels))
+
+    @property
+    def n_channels(self):
+        return self._acc.shape[-1]
+
+    @classmethod
+    def from_tensor(cls, tensor, subjects=None, conditions=CONDITIONS):
+        """
+        Build an accumulator from a (subjects x conditions x channels x channels) tensor,
+        e.g. the ``R6`` matrix of a ``RSFC_GoodCH_AllSub_*`` file.
+        """
+        tensor = np.asarray(tensor)
+        if subjects is None:
+            subjects = [str(i) for i in range(tensor.shape[0])]
+        if len(subjects) != tensor.shape[0]:
+            raise ValueError("subjects has to be the same length as the first dimension of tensor.")
+        acc = cls(tensor.shape[-1], conditions)
+        for subject, data in zip(subjects, tensor):
+            acc.add_subject(subject, data)
+        return acc
+
+    def _condition_index(self, condition):
+        try:
+            return self.conditions.index(condition)
+        except ValueError:
+            raise KeyError(f"Unknown condition '{condition}', expected one of {', '.join(self.conditions)}.")
+
+    @span('accumulator.add_subject')
+    def add_subject(self, subject, data):
+        """
+        Fold a subject's (conditions x channels x channels) result array into the group.
+        """
+        subject = str(subject)
+        if subject in self.subjects:
+            raise ValueError(f"Subject '{subject}' was already added.")
+        self._acc.add(data)
+        self.subjects.append(subject)
+        self.digests[subject] = array_digest(data)
+
+    @span('accumulator.remove_subject')
+    def remove_subject(self, subject, data):
+        """
+        Remove a subject's result array from the group; ``data`` has to be what was added.
+
+        Raises:
+        ------
+        ValueError
+            If ``data`` differs from the array the subject was added with.
+        """
+        subject = str(subject)
+        if subject not in self.subjects:
+            raise KeyError(f"Subject '{subject}' was not added.")
+        if array_digest(data) != self.digests.get(subject):
+            raise ValueError(f"The data does not match the array subject '{subject}' was added with.")
+        self._acc.remove(data)
+        self.subjects.remove(subject)
+        del self.digests[subject]
+
+    def count(self, condition):
+        return self._acc.count[self._condition_index(condition)]
+
+    def mean(self, condition):
+        """
+        Group mean for a condition, equivalent to ``np.nanmean`` across subjects.
+        """
+        return self._acc.mean()[self._condition_index(condition)]
+
+    def var(self, condition, ddof=1):
+        """
+        Group variance for a condition, equivalent to ``np.nanvar`` across subjects.
+        """
+        return self._acc.var(ddof)[self._condition_index(condition)]
+
+    @span('accumulator.save')
+    def save(self, filepath):
+        """
+        Checkpoint the accumulator state to a .npz file.
+
+        The file is written next to its destination first and then moved into place, so an
+        interrupted run never leaves a truncated checkpoint behind.
+        """
+        tmp = f"{filepath}.tmp.npz"
+        np.savez(tmp,
+                 version=_CHECKPOINT_VERSION,
+                 conditions=np.array(self.conditions),
+                 subjects=np.array(self.subjects, dtype=str),
+                 digests=np.array([self.digests[subject] for subject in self.subjects], dtype=str),
+                 count=self._acc.count,
+                 mean=self._acc._mean,
+                 m2=self._acc._m2)
+        os.replace(tmp, filepath)
+
+    @classmethod
+    def load(cls, filepath):
+        """
+        Restore an accumulator from a checkpoint written by ``save``.
+        """
+        if not op.exists(filepath):
+            raise FileNotFoundError(f"The file '{filepath}' was not found.")
+        with np.load(filepath) as data:
+            if int(data['version']) != _CHECKPOINT_VERSION:
+                raise ValueError(f"Unsupported accumulator checkpoint version {int(data['version'])}.")
+            acc = cls(data['count'].shape[-1], [str(c) for c in data['conditions']])
+            acc.subjects = [str(s) for s in data['subjects']]
+            acc.digests = dict(zip(acc.subjects, (str(d) for d in data['digests'])))
+            acc._acc.count = data['count']
+            acc._acc._mean = data['mean']
+            acc._acc._m2 = data['m2']
+        return acc
+
+
+class ChannelMaskedTensor:
+    """
+    A (subjects x conditions x channels x channels) result tensor with packed good-channel
+    masks instead of NaN sentinels.
+
+    Rejected channels are stored as one bit per subject, condition and channel
+    (``np.packbits``), and their rows and columns hold zeros in the value tensor. An edge is
+    valid if both of its channels are good; this outer AND is only formed when needed. Sums
+    over subjects therefore need no masking, and the per-edge number of valid subjects is
+    an integer product of the channel masks. The few NaN values between two good channels
+    (e.g. an undefined diagonal) are also stored as zeros and listed in ``nan_edges``,
+    which corrects the counts, so that ``mean`` and ``var`` equal ``np.nanmean`` and
+    ``np.nanvar``.
+
+    Converting a NaN tensor (``from_nan``) scans it once; the reductions pay off when the
+    packed form is stored (``save``, or ``cli.py pack``) and loaded for later runs.
+
+    Parameters:
+    ----------
+    data : numpy.ndarray, shape (n_subjects, n_conditions, n_channels, n_channels)
+        Values, with zeros on the rows and columns of rejected channels.
+    masks : numpy.ndarray, shape (n_subjects, n_conditions, ceil(n_channels / 8)), uint8
+        Packed good-channel masks.
+    conditions : sequence of str
+        Condition names, in the order of the second axis.
+    nan_edges : numpy.ndarray, shape (n_edges, 4) | None
+        (subject, condition, channel, channel) indices of missing values between good
+        channels.
+
+    Examples:
+    --------
+    >>> r6 = ChannelMaskedTensor.from_nan(load_mat_file(fname, 'R6'), dtype=np.float32)  # doctest:+SKIP
+    >>> r6.save('data/RSFC_GoodCH_AllSub_HC.npz')  # doctest:+SKIP
+    >>> hc_sham = ChannelMaskedTensor.load('data/RSFC_GoodCH_AllSub_HC.npz').mean('sham')  # doctest:+SKIP
+    """
+
+    def __init__(self, data, masks, conditions=CONDITIONS, nan_edges=None):
+        self.data = data
+        self.masks = masks
+        self.conditions = tuple(conditions)
+        self.nan_edges = np.empty((0, 4), dtype=np.int64) if nan_edges is None else np.asarray(nan_edges)
+        if masks.shape != data.shape[:2] + ((data.shape[-1] + 7) // 8,):
+            raise ValueError(f"Masks of shape {masks.shape} do not match a tensor of shape {data.shape}.")
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def n_channels(self):
+        return self.data.shape[-1]
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.masks.nbytes + self.nan_edges.nbytes
+
+    @classmethod
+    @span('masked.from_nan')
+    def from_nan(cls, tensor, conditions=CONDITIONS, dtype=None):
+        """
+        Convert a tensor whose rejected channels are NaN rows and columns.
+
+        A channel is good if its row has any finite value. NaN values on the edges of two
+        good channels are recorded in ``nan_edges``.
+
+        Parameters:
+        ----------
+        tensor : numpy.ndarray, shape (n_subjects, n_conditions, n_channels, n_channels)
+            The result tensor, e.g. ``R6`` of a ``RSFC_GoodCH_AllSub_*`` file.
+        conditions : sequence of str
+            Condition names, in the order of the second axis.
+        dtype : numpy.dtype | None
+            Storage type of the values, e.g. ``np.float32`` to halve the memory footprint.
+        """
+        tensor = np.asarray(tensor)
+        if tensor.ndim != 4 or tensor.shape[-1] != tensor.shape[-2]:
+            raise ValueError(f"Expected a (subjects x conditions x channels x channels) tensor, got {tensor.shape}.")
+        good = np.isfinite(tensor).any(axis=-1)
+        data = np.array(tensor, dtype=dtype or tensor.dtype)
+        bad = ~good
+        data[np.broadcast_to(bad[..., :, None], data.shape)] = 0
+        data[np.broadcast_to(bad[..., None, :], data.shape)] = 0
+
+        missing = np.isnan(data)
+        nan_edges = np.argwhere(missing)
+        data[missing] = 0
+        return cls(data, np.packbits(good, axis=-1), conditions, nan_edges)
+
+    def _condition_index(self, condition):
+        try:
+            return self.conditions.index(condition)
+        except ValueError:
+            raise KeyError(f"Unknown condition '{condition}', expected one of {', '.join(self.conditions)}.")
+
+    def _nan_edges(self, idx):
+        """(subject, channel, channel) indices of the missing values of a condition."""
+        edges = self.nan_edges[self.nan_edges[:, 1] == idx]
+        return edges[:, 0], edges[:, 2], edges[:, 3]
+
+    def channel_mask(self, condition):
+        """
+        Good-channel masks of a condition, shape (n_subjects, n_channels), bool.
+        """
+        packed = self.masks[:, self._condition_index(condition)]
+        return np.unpackbits(packed, axis=-1, count=self.n_channels).view(bool)
+
+    def edge_mask(self, subject, condition):
+        """
+        Valid edges of one subject and condition: the outer AND of its channel mask,
+        without the missing values between good channels.
+        """
+        good = self.channel_mask(condition)[subject]
+        valid = good[:, None] & good[None, :]
+        subjects, rows, cols = self._nan_edges(self._condition_index(condition))
+        valid[rows[subjects == subject], cols[subjects == subject]] = False
+        return valid
+
+    def count(self, condition):
+        """
+        Number of subjects with a valid value on each edge.
+        """
+        good = self.channel_mask(condition).astype(np.int32)
+        count = good.T @ good
+        _, rows, cols = self._nan_edges(self._condition_index(condition))
+        np.subtract.at(count, (rows, cols), 1)
+        return count
+
+    @span('masked.mean')
+    def mean(self, condition):
+        """
+        Group mean for a condition, equivalent to ``np.nanmean`` across subjects.
+        """
+        count = self.count(condition)
+        total = self.data[:, self._condition_index(condition)].sum(axis=0, dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, total / count, np.nan)
+
+    def var(self, condition, ddof=1):
+        """
+        Group variance for a condition, equivalent to ``np.nanvar`` across subjects.
+        """
+        idx = self._condition_index(condition)
+        count = self.count(condition)
+        mean = np.nan_to_num(self.mean(condition))
+
+        good = self.channel_mask(condition)
+        subjects, rows, cols = self._nan_edges(idx)
+        m2 = np.zeros(mean.shape)
+        for subject in range(self.shape[0]):
+            dev = self.data[subject, idx] - mean
+            dev *= good[subject][:, None] & good[subject][None, :]
+            dev[rows[subjects == subject], cols[subjects == subject]] = 0
+            m2 += dev * dev
+        dof = count - ddof
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(dof > 0, m2 / np.maximum(dof, 1), np.nan)
+
+    def to_nan(self):
+        """
+        The tensor with NaN on the rows and columns of rejected channels and on the
+        missing values between good channels.
+        """
+        good = np.unpackbits(self.masks, axis=-1, count=self.n_channels).view(bool)
+        tensor = self.data.astype(np.float64)
+        tensor[np.broadcast_to(~good[..., :, None], tensor.shape)] = np.nan
+        tensor[np.broadcast_to(~good[..., None, :], tensor.shape)] = np.nan
+        tensor[tuple(self.nan_edges.T)] = np.nan
+        return tensor
+
+    @span('masked.save')
+    def save(self, filepath):
+        """
+        Store values and packed masks together in a .npz file (written atomically).
+        """
+        tmp = f"{filepath}.tmp.npz"
+        np.savez(tmp,
+                 version=_MASKED_VERSION,
+                 conditions=np.array(self.conditions),
+                 data=self.data,
+                 masks=self.masks,
+                 nan_edges=self.nan_edges)
+        os.replace(tmp, filepath)
+
+    @classmethod
+    def load(cls, filepath):
+        """
+        Restore a tensor written by ``save``.
+        """
+        if not op.exists(filepath):
+            raise FileNotFoundError(f"The file '{filepath}' was not found.")
+        with np.load(filepath) as data:
+            if int(data['version']) != _MASKED_VERSION:
+                raise ValueError(f"Unsupported masked tensor version {int(data['version'])}.")
+            return cls(data['data'], data['masks'], [str(c) for c in data['conditions']],
+                       data['nan_edges'] if 'nan_edges' in data else None)
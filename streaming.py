@@ -0,0 +1,527 @@
+"""Real-time streaming connectivity.
+
+Sample chunks are consumed from a ``ChunkSource`` with asyncio. For each chunk the optical
+density, a sliding-window scalp coupling index (SCI) and a sliding-window correlation
+matrix are updated incrementally, and a connectivity circle is redrawn at a bounded frame
+rate in a background thread. Per-chunk latencies are measured and reported.
+
+``ArrayReplayer`` and ``FileReplayer`` replay an existing recording at real-time or
+accelerated speed, which allows testing the online pipeline offline.
+
+Differences to the offline pipeline
+-----------------------------------
+- Optical density is computed relative to the mean intensity of the first ``baseline``
+  seconds (the mean of the whole recording is not known yet).
+- Filters are causal (``sosfilt`` with carried-over state) instead of zero-phase, so
+  values lag slightly behind the offline ones.
+
+Usage
+-----
+    source = FileReplayer.from_file('../data_hc/P01/NIRS.nirs', speed=10)
+    processor = StreamingConnectivity(source.sfreq, len(source.ch_names),
+                                      distances=source.distances, wavelengths=source.wavelengths)
+    plotter = CircleFrames(processor.node_names(source.ch_names), filepath='results/live.png')
+    report = asyncio.run(run_stream(source, processor, plotter, max_fps=2))
+"""
+import abc
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from instrument import span
+
+
+class ChunkSource(abc.ABC):
+    """
+    Interface of a streaming data source.
+
+    Subclasses set ``sfreq`` and ``ch_names`` and implement ``chunks``, an asynchronous
+    generator yielding ``(data, first_sample)`` with ``data`` of shape
+    (n_channels, n_samples) as soon as the chunk is available.
+    """
+
+    sfreq = None
+    ch_names = None
+
+    @abc.abstractmethod
+    async def chunks(self):
+        yield
+
+
+class ArrayReplayer(ChunkSource):
+    """
+    Replay an in-memory recording in chunks, paced by the sampling frequency.
+
+    Parameters:
+    ----------
+    data : numpy.ndarray, shape (n_channels, n_times)
+        The raw intensities.
+    sfreq : float
+        Sampling frequency in Hz.
+    ch_names : list of str | None
+        Channel names.
+    chunk_duration : float
+        Duration of each chunk in s.
+    speed : float
+        Replay speed relative to real time, e.g. 10 for ten times faster. ``np.inf``
+        replays as fast as the consumer allows.
+    distances : numpy.ndarray | None
+        Source-detector distances in m, for converting to hemoglobin.
+    wavelengths : tuple of int | None
+        The two wavelengths of each channel pair.
+    """
+
+    def __init__(self, data, sfreq, ch_names=None, chunk_duration=1.0, speed=1.0, distances=None,
+                 wavelengths=None):
+        self.data = data
+        self.sfreq = float(sfreq)
+        self.ch_names = list(ch_names) if ch_names is not None else [str(i) for i in range(len(data))]
+        self.chunk_size = max(1, int(round(chunk_duration * self.sfreq)))
+        self.speed = speed
+        self.distances = distances
+        self.wavelengths = wavelengths
+        self.start_time = None
+
+    def due_time(self, end_sample):
+        """
+        Event loop time at which the sample ``end_sample`` is acquired.
+        """
+        return self.start_time + end_sample / self.sfreq / self.speed
+
+    async def chunks(self):
+        loop = asyncio.get_running_loop()
+        self.start_time = loop.time()
+        n_times = self.data.shape[1]
+        for start in range(0, n_times, self.chunk_size):
+            stop = min(start + self.chunk_size, n_times)
+            # a chunk becomes available once its last sample has been acquired; sleeping
+            # until an absolute due time avoids accumulating drift
+            delay = self.due_time(stop) - loop.time() if np.isfinite(self.speed) else 0.0
+            await asyncio.sleep(max(0.0, delay))
+            yield self.data[:, start:stop], start
+
+
+class FileReplayer(ArrayReplayer):
+    """
+    Replay a ``.nirs`` (NIRx) or ``.snirf`` recording from disk (requires MNE).
+    """
+
+    @classmethod
+    def from_file(cls, filepath, **kwargs):
+        import os.path as op
+
+        import mne
+
+        from preprocessing import raw_to_arrays
+
+        if filepath.endswith('.snirf'):
+            raw = mne.io.read_raw_snirf(filepath, preload=True, verbose=False)
+        else:
+            raw = mne.io.read_raw_nirx(op.dirname(filepath), preload=True, verbose=False)
+        data, distances, wavelengths = raw_to_arrays(raw)
+        return cls(data, raw.info['sfreq'], ch_names=raw.ch_names, distances=distances,
+                   wavelengths=wavelengths, **kwargs)
+
+
+class SlidingCorrelation:
+    """
+    Correlation matrix over the last ``window`` samples, updated in O(channels^2 x chunk).
+
+    Running sums and cross-products are updated with the samples entering and leaving the
+    window; they are recomputed from the ring buffer every ``recompute_every`` updates to
+    bound floating point drift.
+
+    Parameters:
+    ----------
+    n_channels : int
+        Number of channels.
+    window : int
+        Window length in samples.
+    recompute_every : int
+        Number of updates between exact recomputations.
+    """
+
+    def __init__(self, n_channels, window, recompute_every=100):
+        self.window = int(window)
+        self.buffer = np.zeros((n_channels, self.window))
+        self.pos = 0
+        self.filled = 0
+        self.sums = np.zeros(n_channels)
+        self.products = np.zeros((n_channels, n_channels))
+        self.recompute_every = recompute_every
+        self._updates = 0
+
+    def _recompute(self):
+        data = self.buffer if self.filled == self.window else self.buffer[:, :self.filled]
+        self.sums = data.sum(axis=1)
+        self.products = data @ data.T
+
+    def update(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float64)
+        n = chunk.shape[1]
+        if n >= self.window:
+            self.buffer[:] = chunk[:, -self.window:]
+            self.pos, self.filled = 0, self.window
+            self._recompute()
+            return
+
+        idx = (self.pos + np.arange(n)) % self.window
+        if self.filled == self.window:
+            old = self.buffer[:, idx]
+            self.sums -= old.sum(axis=1)
+            self.products -= old @ old.T
+        self.buffer[:, idx] = chunk
+        self.sums += chunk.sum(axis=1)
+        self.products += chunk @ chunk.T
+        self.pos = (self.pos + n) % self.window
+        self.filled = min(self.window, self.filled + n)
+
+        self._updates += 1
+        if self._updates % self.recompute_every == 0:
+            self._recompute()
+
+    def corr(self):
+        """
+        The current correlation matrix, NaN for channels without variance.
+        """
+        if self.filled < 2:
+            return np.full(self.products.shape, np.nan)
+        mean = self.sums / self.filled
+        cov = self.products / self.filled - np.outer(mean, mean)
+        std = np.sqrt(np.clip(np.diag(cov), 0, None))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return cov / np.outer(std, std)
+
+
+class SlidingPairCorrelation:
+    """
+    Correlation between the two channels of each pair (rows ``2i`` and ``2i + 1``) over the
+    last ``window`` samples, updated in O(channels x chunk).
+
+    Only the sums and sums of squares of each channel and the cross-products within each
+    pair are kept, which is all the scalp coupling index needs.
+
+    Parameters:
+    ----------
+    n_channels : int
+        Number of channels, two per pair.
+    window : int
+        Window length in samples.
+    recompute_every : int
+        Number of updates between exact recomputations.
+    """
+
+    def __init__(self, n_channels, window, recompute_every=100):
+        self.window = int(window)
+        self.buffer = np.zeros((n_channels, self.window))
+        self.pos = 0
+        self.filled = 0
+        self.sums = np.zeros(n_channels)
+        self.squares = np.zeros(n_channels)
+        self.cross = np.zeros(n_channels // 2)
+        self.recompute_every = recompute_every
+        self._updates = 0
+
+    def _pair_products(self, data):
+        pairs = len(self.cross)
+        return np.einsum('ij,ij->i', data[0:2 * pairs:2], data[1:2 * pairs:2])
+
+    def _recompute(self):
+        data = self.buffer if self.filled == self.window else self.buffer[:, :self.filled]
+        self.sums = data.sum(axis=1)
+        self.squares = np.einsum('ij,ij->i', data, data)
+        self.cross = self._pair_products(data)
+
+    def update(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float64)
+        n = chunk.shape[1]
+        if n >= self.window:
+            self.buffer[:] = chunk[:, -self.window:]
+            self.pos, self.filled = 0, self.window
+            self._recompute()
+            return
+
+        idx = (self.pos + np.arange(n)) % self.window
+        if self.filled == self.window:
+            old = self.buffer[:, idx]
+            self.sums -= old.sum(axis=1)
+            self.squares -= np.einsum('ij,ij->i', old, old)
+            self.cross -= self._pair_products(old)
+        self.buffer[:, idx] = chunk
+        self.sums += chunk.sum(axis=1)
+        self.squares += np.einsum('ij,ij->i', chunk, chunk)
+        self.cross += self._pair_products(chunk)
+        self.pos = (self.pos + n) % self.window
+        self.filled = min(self.window, self.filled + n)
+
+        self._updates += 1
+        if self._updates % self.recompute_every == 0:
+            self._recompute()
+
+    def corr(self):
+        """
+        The current correlation of each pair, NaN for pairs with a constant channel.
+        """
+        if self.filled < 2:
+            return np.full(len(self.cross), np.nan)
+        n = 2 * len(self.cross)
+        mean = self.sums[:n] / self.filled
+        var = np.clip(self.squares[:n] / self.filled - mean ** 2, 0, None)
+        cov = self.cross / self.filled - mean[0::2] * mean[1::2]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return cov / np.sqrt(var[0::2] * var[1::2])
+
+
+class _CausalFilter:
+    """Band-pass filter applied chunk by chunk, carrying the filter state over."""
+
+    def __init__(self, band, sfreq, n_channels, order=4):
+        from scipy.signal import butter, sosfilt_zi
+
+        self.sos = butter(order, band, btype='bandpass', fs=sfreq, output='sos')
+        self.zi = np.repeat(sosfilt_zi(self.sos)[:, None, :], n_channels, axis=1) * 0.0
+
+    def __call__(self, chunk):
+        from scipy.signal import sosfilt
+
+        out, self.zi = sosfilt(self.sos, chunk, axis=-1, zi=self.zi)
+        return out
+
+
+class StreamingConnectivity:
+    """
+    Incremental optical density, quality and connectivity estimation for one recording.
+
+    Parameters:
+    ----------
+    sfreq : float
+        Sampling frequency in Hz.
+    n_channels : int
+        Number of channels (two wavelengths per source-detector pair, adjacent).
+    window : float
+        Length of the connectivity window in s.
+    sci_window : float
+        Length of the scalp coupling index window in s.
+    baseline : float
+        Duration in s of the initial period whose mean intensity is the optical density
+        reference.
+    conn_band : tuple of float
+        Pass band (Hz) of the signals the connectivity is computed on.
+    cardiac_band : tuple of float
+        Pass band (Hz) of the scalp coupling index.
+    distances : numpy.ndarray | None
+        Source-detector distances in m. If given together with ``wavelengths``, the
+        connectivity is computed on HbO instead of the optical density of all channels.
+    wavelengths : tuple of int | None
+        The two wavelengths of each channel pair.
+    decimate_to : float | None
+        If given, the connectivity signals are decimated to about this sampling frequency
+        (see ``preprocessing.Decimator``) after the scalp coupling index, which needs the
+        cardiac band, has been updated.
+    """
+
+    def __init__(self, sfreq, n_channels, window=60.0, sci_window=10.0, baseline=30.0, conn_band=(0.01, 0.1),
+                 cardiac_band=(0.7, 1.5), distances=None, wavelengths=None, decimate_to=None):
+        self.sfreq = sfreq
+        self.n_channels = n_channels
+        self.hemoglobin = distances is not None and wavelengths is not None
+        self.distances = distances
+        self.wavelengths = wavelengths
+
+        self._baseline_samples = int(baseline * sfreq)
+        self._intensity_sum = np.zeros(n_channels)
+        self._n_seen = 0
+
+        self._decimator = None
+        conn_sfreq = sfreq
+        if decimate_to is not None:
+            from preprocessing import Decimator
+
+            self._decimator = Decimator(sfreq, decimate_to)
+            conn_sfreq = self._decimator.sfreq_out
+
+        n_conn = n_channels // 2 if self.hemoglobin else n_channels
+        self._conn_filter = _CausalFilter(conn_band, conn_sfreq, n_conn)
+        self._cardiac_filter = _CausalFilter(cardiac_band, sfreq, n_channels)
+        self.connectivity = SlidingCorrelation(n_conn, int(window * conn_sfreq))
+        self.quality = SlidingPairCorrelation(n_channels, int(sci_window * sfreq))
+
+    def node_names(self, ch_names):
+        """
+        Names of the connectivity nodes, i.e. the HbO channels or all channels.
+        """
+        if self.hemoglobin:
+            return [f"{name.split(' ')[0]} hbo" for name in ch_names[::2]]
+        return list(ch_names)
+
+    @span('stream.optical_density')
+    def optical_density(self, chunk):
+        # zeros are replaced by the smallest positive value of the same channel
+        intensity = np.abs(chunk)
+        floor = np.where(intensity > 0, intensity, np.inf).min(axis=1, keepdims=True)
+        floor[np.isinf(floor)] = 1.0
+        intensity = np.where(intensity > 0, intensity, floor)
+
+        # the reference is the running mean until the baseline period is complete
+        if self._n_seen < self._baseline_samples or self._n_seen == 0:
+            self._intensity_sum += intensity.sum(axis=1)
+            self._n_seen += intensity.shape[1]
+        reference = self._intensity_sum / self._n_seen
+        return -np.log(intensity / reference[:, None])
+
+    @span('stream.update')
+    def update(self, chunk):
+        """
+        Process one chunk of raw intensities.
+
+        Returns:
+        -------
+        dict
+            ``od``, the optical density of the chunk.
+        """
+        od = self.optical_density(chunk)
+        self.quality.update(self._cardiac_filter(od))
+
+        signal = od
+        if self.hemoglobin:
+            from preprocessing import beer_lambert
+
+            signal = beer_lambert(od, self.distances, self.wavelengths)[::2]
+        if self._decimator is not None:
+            signal = self._decimator.process(signal)
+        if signal.shape[-1]:
+            self.connectivity.update(self._conn_filter(signal))
+        return dict(od=od)
+
+    def sci(self):
+        """
+        Scalp coupling index of each channel pair over the last ``sci_window`` seconds.
+        """
+        return self.quality.corr()
+
+    def corr(self):
+        """
+        Connectivity (correlation) matrix over the last ``window`` seconds.
+        """
+        return self.connectivity.corr()
+
+
+class CircleFrames:
+    """
+    Draw connectivity circles into one reused figure, in a dedicated worker thread.
+
+    Parameters:
+    ----------
+    node_names : list of str
+        Node names of the connectivity matrix.
+    filepath : str | None
+        If given, every frame is saved to this file (overwriting the previous frame).
+    n_lines : int | None
+        Number of strongest connections to draw.
+    **kwargs
+        Passed on to ``plot_connectivity_circle``.
+    """
+
+    def __init__(self, node_names, filepath=None, n_lines=300, **kwargs):
+        self.node_names = list(node_names)
+        self.filepath = filepath
+        self.plot_kwargs = dict(n_lines=n_lines, colormap='RdBu_r', vmin=-1, vmax=1, facecolor='white',
+                                textcolor='black', colorbar=False, show=False)
+        self.plot_kwargs.update(kwargs)
+        self._fig = None
+        self._ax = None
+
+    def draw(self, corr, title=None):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        from circular import plot_connectivity_circle
+
+        if self._fig is None:
+            self._fig = Figure(figsize=(8, 8), facecolor='white')
+            FigureCanvasAgg(self._fig)
+            self._ax = self._fig.add_subplot(polar=True)
+        self._ax.clear()
+        plot_connectivity_circle(np.nan_to_num(corr), self.node_names, ax=self._ax, title=title,
+                                 **self.plot_kwargs)
+        if self.filepath is not None:
+            self._fig.savefig(self.filepath, facecolor='white')
+        else:
+            self._fig.canvas.draw()
+
+
+def _latency_summary(values):
+    if not values:
+        return None
+    values = np.asarray(values) * 1e3
+    return dict(mean_ms=float(values.mean()), p50_ms=float(np.percentile(values, 50)),
+                p95_ms=float(np.percentile(values, 95)), max_ms=float(values.max()))
+
+
+async def run_stream(source, processor, plotter=None, max_fps=2.0, on_chunk=None):
+    """
+    Consume a source until it is exhausted, updating the processor with every chunk and
+    refreshing the plot at most ``max_fps`` times per second.
+
+    Frames are rendered in a single background thread. If the previous frame is still
+    being drawn, the refresh is skipped rather than queued, so slow rendering never delays
+    the processing of incoming chunks.
+
+    Parameters:
+    ----------
+    source : ChunkSource
+        The data source.
+    processor : StreamingConnectivity
+        The incremental estimator.
+    plotter : CircleFrames | None
+        Draws the connectivity frames.
+    max_fps : float
+        Maximum number of frames per second.
+    on_chunk : callable | None
+        Called with ``(processor, first_sample)`` after each chunk.
+
+    Returns:
+    -------
+    dict
+        Latency report: processing time per chunk, delay between a chunk's acquisition
+        time and the end of its processing (for paced sources), and frame counts.
+    """
+    loop = asyncio.get_running_loop()
+    processing, delays = [], []
+    n_chunks = n_frames = n_skipped = 0
+    last_frame = -np.inf
+    pending = None
+    executor = ThreadPoolExecutor(max_workers=1) if plotter is not None else None
+
+    start = time.perf_counter()
+    try:
+        async for chunk, first_sample in source.chunks():
+            t_arrival = loop.time()
+            processor.update(chunk)
+            t_done = loop.time()
+            processing.append(t_done - t_arrival)
+            if getattr(source, 'start_time', None) is not None and np.isfinite(getattr(source, 'speed', np.inf)):
+                delays.append(t_done - source.due_time(first_sample + chunk.shape[1]))
+            n_chunks += 1
+            if on_chunk is not None:
+                on_chunk(processor, first_sample)
+
+            if plotter is not None and t_done - last_frame >= 1.0 / max_fps:
+                if pending is not None and not pending.done():
+                    n_skipped += 1
+                else:
+                    title = f"{(first_sample + chunk.shape[1]) / source.sfreq:.0f} s"
+                    pending = loop.run_in_executor(executor, plotter.draw, processor.corr(), title)
+                    last_frame = t_done
+                    n_frames += 1
+        if pending is not None:
+            await pending
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    return dict(chunks=n_chunks, frames=n_frames, skipped_frames=n_skipped,
+                wall_seconds=time.perf_counter() - start,
+                processing=_latency_summary(processing), delay=_latency_summary(delays))
@@ -1,7 +1,9 @@
 import numpy as np
 
-from scipy.io import loadmat
+from instrument import span
 
+
+@span('load_mat_file')
 def load_mat_file(filepath, key):
     """
     Load a specific matrix from a MATLAB .mat file.
@@ -18,6 +20,8 @@ def load_mat_file(filepath, key):
     numpy.ndarray
         The matrix associated with the specified key.
     """
+    from scipy.io import loadmat
+
     try:
         mat_data = loadmat(filepath)
         if key in mat_data:
@@ -28,6 +32,7 @@ def load_mat_file(filepath, key):
         raise FileNotFoundError(f"The file '{filepath}' was not found.")
 
 
+@span('load_labels_from_mat')
 def load_labels_from_mat(filepath, key):
     """
     Load and extract labels from a MATLAB .mat file, converting them into a 2D array.
@@ -52,6 +57,8 @@ def load_labels_from_mat(filepath, key):
     FileNotFoundError
         If the specified file is not found.
     """
+    from scipy.io import loadmat
+
     try:
         mat_data = loadmat(filepath)
         if key in mat_data: